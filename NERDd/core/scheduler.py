@@ -50,7 +50,7 @@ class Scheduler():
         trigger = CronTrigger(year, month, day, week, day_of_week, hour, minute,
             second, timezone=timezone)
         self.sched.add_job(func, trigger, args, kwargs, coalesce=True, max_instances=1, id=str(self.last_job_id))
-        self.log.debug("Registered function {0} to be called at {1}".format(func.__qualname__, trigger))
+        self.log.debug("Registered function %s to be called at %s", func.__qualname__, trigger)
         return self.last_job_id
 
     def pause_job(self, id):
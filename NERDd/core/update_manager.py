@@ -503,7 +503,7 @@ class UpdateManager:
             duration = (datetime.now() - start_time).total_seconds()
             #self.log.debug("Task {} finished in {:.3f} seconds.".format(msg_id, duration))
             if duration > 1.0:
-                self.log.debug("Task {} took {} seconds: {}/{} {}{}".format(msg_id, duration, etype, eid, updreq, " (new record created)" if created else ""))
+                self.log.debug("Task %s took %s seconds: %s/%s %s%s", msg_id, duration, etype, eid, updreq, " (new record created)" if created else "")
 
             # # Increment corresponding update counter
             # # TODO: replace this by event_count_logger
@@ -538,7 +538,7 @@ class UpdateManager:
                     self._watchdog_restarts += 1
                 else:
                     self.log.critical("Thread {} is dead, more than 20 restarts attempted, giving up...".format(worker.name))
-                    g.daemon_stop_lock.release()  # Exit program
+                    g.stop_event.set()  # Exit program
                     break
 
     def _dbg_worker_status_print(self):
@@ -625,7 +625,7 @@ class UpdateManager:
         if rec is None:
             if weak_op:
                 update_requests.clear()
-                self.log.debug("Received only weak operations for non-existent entity {} of type {}. Aborting record creation.".format(etype, eid))
+                self.log.debug("Received only weak operations for non-existent entity %s of type %s. Aborting record creation.", etype, eid)
             else:
                 now = datetime.utcnow()
                 rec = {
@@ -773,7 +773,7 @@ class UpdateManager:
         # Remove or update processed database record
         if deletion:
             self.db.delete(etype, eid)
-            self.log.debug("Entity '{}' of type '{}' was removed from the database.".format(eid, etype))
+            self.log.debug("Entity '%s' of type '%s' was removed from the database.", eid, etype)
         else:
             self.db.put(etype, eid, rec)
 
@@ -75,7 +75,7 @@ class CIRCL_BGPRank(NERDModule):
             pos = reply['response']['ranking']['position']
             if not reply['response']['asn_description'] and rank == 0.0 and pos is None:
                 self.log.info("ASN {} not found in BGP ranking database".format(key))
-            self.log.debug("Setting BGPRank of ASN {} to {}".format(key, rank))
+            self.log.debug("Setting BGPRank of ASN %s to %s", key, rank)
         except Exception as e:
             self.log.error("Can't get BGPRank of ASN {}: {}".format(key, str(e)))
             return None             # could be connection error etc.
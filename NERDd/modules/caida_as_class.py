@@ -48,7 +48,7 @@ class CaidaASclass(NERDModule):
         Dictionary with AS number as a key and dictionary with source and class (class name from configuration file is used if is set) as a value
         """
 
-        self.log.debug("Start parsing Caida list stored at path {}.".format(path))
+        self.log.debug("Start parsing Caida list stored at path %s.", path)
         ASN_dictionary = {}
         
         try:
@@ -117,7 +117,7 @@ class CaidaASclass(NERDModule):
 
         res = self.search_in_dict(key)
         if res is not None:
-            self.log.debug("ASN: {} has class: {} (source: {}, confidence: {}) according to CAIDA.".format(key, res["class"], res["source"], res["confidence"]))
+            self.log.debug("ASN: %s has class: %s (source: %s, confidence: %s) according to CAIDA.", key, res["class"], res["source"], res["confidence"])
             ret = [('set', 'caida_as_class.v', res["class"])]
             if res["confidence"] != 1:
                 ret.append(('set', 'caida_as_class.c', res["confidence"]))
@@ -69,7 +69,7 @@ class Cleaner(NERDModule):
         if actions:
             actions.append(('set', 'events_meta.total', num_events))
         
-        self.log.debug("Cleaning {}: Removing {} old event-records".format(key, len(actions)-1))
+        self.log.debug("Cleaning %s: Removing %s old event-records", key, len(actions)-1)
         return actions
 
     def clear_bl_hist(self, ekey, rec, updates):
@@ -199,7 +199,7 @@ class DNSBLResolver(NERDModule):
         ip = ekey[1]
         revip = reverse_ip(ip)
 
-        self.log.debug("Querying blacklists for {}".format(ekey))
+        self.log.debug("Querying blacklists for %s", ekey)
         
         channel = pycares.Channel(servers=self.nameservers)
         results = []        
@@ -213,7 +213,7 @@ class DNSBLResolver(NERDModule):
         #(they are handled by self._process_result callback)
         _wait_channel(channel)
         
-        self.log.debug("DNSBL for {}: {}".format(ip, results))
+        self.log.debug("DNSBL for %s: %s", ip, results)
         
         actions = []
         
@@ -221,11 +221,11 @@ class DNSBLResolver(NERDModule):
             for blname in bl[2].values():
                 if blname in results:
                     # IP is on blacklist blname
-                    self.log.debug("IP address ({0}) is on {1}.".format(key, blname))
+                    self.log.debug("IP address (%s) is on %s.", key, blname)
                     actions.append( ('array_upsert', 'bl', {'n': blname}, [('set', 'v', 1), ('set', 't', req_time), ('append', 'h', req_time)]) )
                 else:
                     # IP is not on blacklist blname
-                    self.log.debug("IP address ({0}) is not on {1}.".format(key, blname))
+                    self.log.debug("IP address (%s) is not on %s.", key, blname)
                     actions.append( ('array_update', 'bl', {'n': blname}, [('set', 'v', 0), ('set', 't', req_time)]) )
                     # Note: array_update change the record only if the matching element is there, if the IP wasn't on the blacklist before, it does nothing
         
@@ -69,12 +69,12 @@ class DShield(NERDModule):
             # if some value is missing, DShield have no data for the IP (or the record is damaged), do not store
             if not (dshield_record['reports'] and dshield_record['targets'] and dshield_record['mindate'] and
                     dshield_record['maxdate']):
-                self.log.debug("No data in DShield for IP {}".format(key))
+                self.log.debug("No data in DShield for IP %s", key)
                 return None
 
         except Exception as e:
             self.log.error("Can't get DShield data for IP {}: {}".format(key, e))
             return None             # could be connection error etc.
 
-        self.log.debug("DShield record for IP {}: {}".format(key, dshield_record))
+        self.log.debug("DShield record for IP %s: %s", key, dshield_record)
         return [('set', 'dshield', dshield_record)]
@@ -318,7 +318,7 @@ class EventReceiver(NERDModule):
                     for ipv4 in src.get("IP4", []):
                         # TODO check IP address validity
 
-                        self.log.debug("EventReceiver: Updating IPv4 record {}".format(ipv4))
+                        self.log.debug("EventReceiver: Updating IPv4 record %s", ipv4)
                         cat = '+'.join(event["Category"]).replace('.', '')
                         # Parse and reformat detect time
                         detect_time = parse_rfc_time(event["DetectTime"]) # Parse DetectTime
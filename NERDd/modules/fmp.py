@@ -202,7 +202,7 @@ class FMP(NERDModule):
     def logFMP(self, ip, fv, fmp, attacked, path):
         # Acquire current UTC time.
         curTime = datetime.utcnow()
-        logTime = curTime.strftime("%Y-%m-%dT%H:%M:%S")
+        logTime = curTime.isoformat(timespec='seconds')
         fileSuffix = curTime.strftime("%Y_%m_%d")
 
         # Create strings to be inserted into log files.
@@ -76,7 +76,7 @@ class HostnameClass(NERDModule):
         hostname = rec["hostname"]
 
         if hostname is None:
-            self.log.debug("Hostname attribute is not filled for IP ({}).".format(key))
+            self.log.debug("Hostname attribute is not filled for IP (%s).", key)
             return None
         
         tags = []
@@ -87,7 +87,7 @@ class HostnameClass(NERDModule):
             portion = hostname.split(".",i)[-1]
             if portion in self.known_domains:
                 tag = self.known_domains[portion]
-                self.log.debug("Hostname ({}) ends with domain {} and has been classified as {}.".format(hostname, portion, tag))
+                self.log.debug("Hostname (%s) ends with domain %s and has been classified as %s.", hostname, portion, tag)
                 if tag not in tags:
                     tags.append(tag)
                 break
@@ -110,7 +110,7 @@ class HostnameClass(NERDModule):
                     if not ip_adress_matched:
                         continue
 
-                self.log.debug("Hostname ({}) matches regex {} and has been classified as {}.".format(hostname, regex[0].pattern, tag))
+                self.log.debug("Hostname (%s) matches regex %s and has been classified as %s.", hostname, regex[0].pattern, tag)
                 if tag not in tags:
                     tags.append(tag)
 
@@ -46,14 +46,14 @@ class PassiveDNSResolver(NERDModule):
         
         # Load configuration of blacklists to get Redis connection params
         bl_config_file = os.path.join(g.config_base_path, g.config.get("bl_config", "blacklists.yml"))
-        self.log.debug("Loading blacklists configuration from {}".format(bl_config_file))
+        self.log.debug("Loading blacklists configuration from %s", bl_config_file)
         bl_config = common.config.read_config(bl_config_file)
         
         # Connect to Redis
         redis_host = bl_config.get("redis.host", "localhost")
         redis_port = bl_config.get("redis.port", 6379)
         redis_db_index = bl_config.get("redis.db", 0)
-        self.log.debug("Connecting to Redis: {}:{}/{}".format(redis_host, redis_port, redis_db_index))
+        self.log.debug("Connecting to Redis: %s:%s/%s", redis_host, redis_port, redis_db_index)
         self.redis = redis.StrictRedis(host=redis_host, port=redis_port, db=redis_db_index)
         
         # List of blacklists is get automatically from Redis
@@ -68,7 +68,7 @@ class PassiveDNSResolver(NERDModule):
         self.log.info("Loaded {} domain blacklists: {}".format(len(blnames), ', '.join(blnames)))
 
         itemlist = ['dbl.' + id for id in blnames]
-        self.log.debug("Registering {0}".format(itemlist))
+        self.log.debug("Registering %s", itemlist)
         g.um.register_handler(
             self.passive_dns_query,
             'ip',
@@ -111,14 +111,14 @@ class PassiveDNSResolver(NERDModule):
              
         domains = [x['domain'] for x in response.json()]
         if domains:
-            self.log.debug('Passive DNS match: {} -> {}'.format(key, domains))
+            self.log.debug('Passive DNS match: %s -> %s', key, domains)
         for domain in domains: # Check domain against all available blacklists 
             domain = domain[:-1] # Remove dot, beacuse domains on Passive DNS are stored in fully qualified format.
             for dbl in self.blacklists:
                 time, present = dbl.check(domain)
                 blname = dbl.id
                 if present:
-                    self.log.debug("Domain ({0}) is on blacklist {1}.".format(domain, blname))
+                    self.log.debug("Domain (%s) is on blacklist %s.", domain, blname)
                     actions.append( ('array_upsert', 'dbl', {'n': blname, 'd': domain}, [('set', 'v', 1), ('set', 't', time), ('append', 'h', time)]) )
                 else:
                     # Domain is not on blacklist
@@ -75,14 +75,14 @@ class RedisBlacklist(NERDModule):
         #self.log.setLevel("DEBUG")
         # Load configuration of blacklists (separate from main config)
         bl_config_file = os.path.join(g.config_base_path, g.config.get("bl_config", "blacklists.yml"))
-        self.log.debug("Loading blacklists configuration from {}".format(bl_config_file))
+        self.log.debug("Loading blacklists configuration from %s", bl_config_file)
         bl_config = common.config.read_config(bl_config_file)
         
         # Connect to Redis
         redis_host = bl_config.get("redis.host", "localhost")
         redis_port = bl_config.get("redis.port", 6379)
         redis_db_index = bl_config.get("redis.db", 0)
-        self.log.debug("Connecting to Redis: {}:{}/{}".format(redis_host, redis_port, redis_db_index))
+        self.log.debug("Connecting to Redis: %s:%s/%s", redis_host, redis_port, redis_db_index)
         self.redis = redis.StrictRedis(host=redis_host, port=redis_port, db=redis_db_index)
         
         # List of blacklists is get automatically from Redis
@@ -105,7 +105,7 @@ class RedisBlacklist(NERDModule):
         # blacklist (bl) and prefix blacklist (pbl) can change
         itemlist = ['bl:' + id for id in bl_names]
         itemlist = itemlist + ['pbl:' + id for id in pbl_names]
-        self.log.debug("Registering {0}".format(itemlist))
+        self.log.debug("Registering %s", itemlist)
         g.um.register_handler(
             self.search_ip,
             'ip',
@@ -148,11 +148,11 @@ class RedisBlacklist(NERDModule):
             blname = bl.id
             if present:
                 # IP is on blacklist
-                self.log.debug("IP address ({0}) is on {1}.".format(key, blname))
+                self.log.debug("IP address (%s) is on %s.", key, blname)
                 actions.append( ('array_upsert', 'bl', {'n': blname}, [('set', 'v', 1), ('set', 't', time), ('append', 'h', time)]) )
             else:
                 # IP is not on blacklist
-                self.log.debug("IP address ({0}) is not on {1}.".format(key, blname))
+                self.log.debug("IP address (%s) is not on %s.", key, blname)
                 actions.append( ('array_update', 'bl', {'n': blname}, [('set', 'v', 0), ('set', 't', time)]) )
 
         # In case of error, remove blacklists not already present
@@ -168,7 +168,7 @@ class Refresher(NERDModule):
                 #print(key, actions)
                 g.um.update((etype,key), actions.copy())
                 if (i+1) % 1000 == 0:
-                    self.log.debug("{} entities updated.".format(i+1))
+                    self.log.debug("%s entities updated.", i+1)
             
             self.log.info("Done, {} entities updated".format(i+1))
 
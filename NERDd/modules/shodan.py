@@ -93,14 +93,14 @@ class Shodan(NERDModule):
         
         ip = key
 
-        self.log.debug("Querying Shodan for {}".format(ip))
+        self.log.debug("Querying Shodan for %s", ip)
         
         try:
             with shodan_api_lock: # This ensures only one thread can process the query at a time
                 data = self.client.host(ip, minify=True)
         except shodan.exception.APIError as e:
             if str(e) == "No information available for that IP.":
-                self.log.debug("Shodan info for {}: Not found".format(ip))
+                self.log.debug("Shodan info for %s: Not found", ip)
                 # Store empty dict into "shodan" key to mark that the info was queried but the IP is not in Shodan DB
                 return [('set', 'shodan', dict())]
             else:
@@ -111,7 +111,7 @@ class Shodan(NERDModule):
                     self.enabled = False
             return None
         
-        self.log.debug("Shodan info for {}: {}".format(ip, data))
+        self.log.debug("Shodan info for %s: %s", ip, data)
         
         update_requests = []
 
@@ -154,6 +154,6 @@ class Shodan(NERDModule):
                 self.log.error("Error when querying '{}': Unexpected format of 'tags': {}".format(ip, repr(tags)))
         
         
-        self.log.debug("Shodan update requests for {}: {}".format(ip, update_requests))
+        self.log.debug("Shodan update requests for %s: %s", ip, update_requests)
         
         return update_requests
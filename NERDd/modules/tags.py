@@ -59,7 +59,7 @@ class Tags(NERDModule):
             
             # create two-tuple from ASTs of tag condition and info and add it to dict
             self.tags[tag_id] = (condition,info)            
-            self.log.debug("Tag \"{}\" has been parsed.".format(tag_id))
+            self.log.debug("Tag \"%s\" has been parsed.", tag_id)
 
         self.log.info("{} tags have been parsed.".format(len(self.tags)))
         
@@ -76,7 +76,7 @@ class Tags(NERDModule):
                     self.triggers[var] = [tag_id]
             
         for var, tag_list in self.triggers.items():
-            self.log.debug("Attribute {} will trigger evaluation of tags: {}.".format(var, tag_list))
+            self.log.debug("Attribute %s will trigger evaluation of tags: %s.", var, tag_list)
         
         # Create list of attributes which may be changed by this module
         changes = []
@@ -86,7 +86,7 @@ class Tags(NERDModule):
             changes.append("tags." + tag_id + ".time_modified")
             if tag_params[1] is not None:
                 changes.append("tags." + tag_id + ".info")
-        self.log.debug("Tag module may update attributes: {}.".format(changes))
+        self.log.debug("Tag module may update attributes: %s.", changes)
         
 
         attribute_triggers = list(self.triggers.keys())
@@ -177,7 +177,7 @@ class Tags(NERDModule):
             for updated_attr,updated_val in updates:
                 if not updated_attr.startswith("!") and updated_attr in self.triggers:
                     tags_for_update.update(self.triggers[updated_attr])
-        self.log.debug("Updating tags for IP {}. Tags to be re-evaluated: {}.".format(key, tags_for_update))
+        self.log.debug("Updating tags for IP %s. Tags to be re-evaluated: %s.", key, tags_for_update)
 
         # Evaluate condition for each tag from set. Evaluate confidence and format info if condition is met.
         # Add two-tuple of confidence value and info to updated_tags dict if condition is met
@@ -189,9 +189,9 @@ class Tags(NERDModule):
                 eval_confidence = condition.evaluate_mathematical(eval_value)
                 eval_info = info.evaluate(rec) if info is not None else None
                 updated_tags[tag_id] = (eval_confidence, eval_info)
-                self.log.debug("Tag {} satisfies condition for IP {} - confidence: {}, info: \"{}\".".format(tag_id, key, eval_confidence, eval_info))
+                self.log.debug("Tag %s satisfies condition for IP %s - confidence: %s, info: \"%s\".", tag_id, key, eval_confidence, eval_info)
             else:
-                self.log.debug("Tag {} does not satisfy condition for IP {}.".format(tag_id, key))
+                self.log.debug("Tag %s does not satisfy condition for IP %s.", tag_id, key)
         
         # Create appropriate update request for each tag which may be updated
         ret = []
@@ -201,7 +201,7 @@ class Tags(NERDModule):
             for tag_id in rec["tags"]:
                 if tag_id not in tags_for_update:
                     ret.append(('remove', 'tags.' + tag_id))
-                    self.log.debug("Obsolete tag {} has been deleted from record for IP {}.".format(tag_id,key))
+                    self.log.debug("Obsolete tag %s has been deleted from record for IP %s.", tag_id, key)
 
         for tag_id in tags_for_update:
             # Update confidence or info in entity record if these values has been changed, otherwise do nothing
@@ -211,9 +211,9 @@ class Tags(NERDModule):
                     if updated_tags[tag_id][1] is not None:
                         ret.append(('set', 'tags.' + tag_id + '.info', updated_tags[tag_id][1]))
                     ret.append(('set', 'tags.' + tag_id + '.time_modified', datetime.datetime.utcnow()))
-                    self.log.debug("Tag {} has been updated in record for IP {}.".format(tag_id,key))
+                    self.log.debug("Tag %s has been updated in record for IP %s.", tag_id, key)
                 else:
-                    self.log.debug("Tag {} has been already added to record for IP {} and nothing changed.".format(tag_id,key))
+                    self.log.debug("Tag %s has been already added to record for IP %s and nothing changed.", tag_id, key)
             # Add new tag to entity record
             elif tag_id in updated_tags:
                 ret.append(('set', 'tags.'+ tag_id + '.confidence', updated_tags[tag_id][0]))
@@ -222,11 +222,11 @@ class Tags(NERDModule):
                 time = datetime.datetime.utcnow()
                 ret.append(('set', 'tags.' + tag_id + '.time_added', time))
                 ret.append(('set', 'tags.' + tag_id + '.time_modified', time))
-                self.log.debug("Tag {} is new for IP {} and has been added to record.".format(tag_id,key))
+                self.log.debug("Tag %s is new for IP %s and has been added to record.", tag_id, key)
             # Remove tag which does not satisfy condition after attribute update
             elif "tags" in rec and tag_id in rec["tags"]:
                 ret.append(('remove', 'tags.' + tag_id))
-                self.log.debug("Tag {} has been deleted from record for IP {}.".format(tag_id,key))
+                self.log.debug("Tag %s has been deleted from record for IP %s.", tag_id, key)
 
         return ret
                 
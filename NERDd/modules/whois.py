@@ -535,7 +535,7 @@ class WhoIS(NERDModule):
 
             data_dict = self.receiveData(org, 'whois.lacnic.net', self.parseRIR, (map_dict, 3))
             if data_dict == None:
-                self.log.debug('Unable to find organization: {} in RIR: {}. Attempting "whois.registro.br".'.format(org, rir))
+                self.log.debug('Unable to find organization: %s in RIR: %s. Attempting "whois.registro.br".', org, rir)
                 map_dict = {
                     'owner' : 'name',
                     'responsible' : 'contact'
@@ -84,7 +84,7 @@ def issue_events(db, task_queue_writer, log, fetch_limit):
             if time > max_time:
                 continue # expired entry, ignore
             additional_events[etype].append(event)
-            log.debug("Additional event '{}' will be issued for all entities of type '{}'".format(event, etype))
+            log.debug("Additional event '%s' will be issued for all entities of type '%s'", event, etype)
     except FileNotFoundError:
         pass # File doesn't exist - that's OK, do nothing
     except Exception as e:
@@ -100,7 +100,7 @@ def issue_events(db, task_queue_writer, log, fetch_limit):
         #  fetch the same entity twice)
         # Note: This algorithm depends on the fact that lists of 1d and 1w are always subsets of 4h.
         #       If other intervals will be added in the future, it might need change.
-        log.debug("Getting list of '{}' entities to update ...".format(etype))
+        log.debug("Getting list of '%s' entities to update ...", etype)
         ids4h = set()#set(g.db.find(etype, {'_nru4h': {'$lte': time, '$gt': self.last_fetch_time}}, limit=self.FETCH_LIMIT))
         ids1d = set(db.find(etype, {'_nru1d': {'$lte': time, '$gt': last_fetch_time}}, limit=fetch_limit))
         ids1w = set(db.find(etype, {'_nru1w': {'$lte': time, '$gt': last_fetch_time}}, limit=fetch_limit))
@@ -135,7 +135,7 @@ def issue_events(db, task_queue_writer, log, fetch_limit):
             # Issue update requests
             task_queue_writer.put_task(etype, id, requests)
             if (n+1) % 100 == 0:
-                log.debug("Requests for {} records submitted.".format(n+1))
+                log.debug("Requests for %s records submitted.", n+1)
 
     last_fetch_time = time
 
@@ -179,11 +179,11 @@ if __name__ == "__main__":
     log.info("**** Updater started *****")
 
     # Determine final path to nerdd.yml file and read the configuration
-    log.debug("Loading config file {}".format(args.cfg_file))
+    log.debug("Loading config file %s", args.cfg_file)
     config = common.config.read_config(args.cfg_file)
     config_base_path = os.path.dirname(os.path.abspath(args.cfg_file))
     common_cfg_file = os.path.join(config_base_path, config.get('common_config'))
-    log.debug("Loading config file {}".format(common_cfg_file))
+    log.debug("Loading config file %s", common_cfg_file)
     config.update(common.config.read_config(common_cfg_file))
 
     additional_events_file = os.path.join(config_base_path, CONFIG_FILE_NAME)
@@ -420,7 +420,7 @@ def put_set_to_database():
     if eventdb is None:
         return
     if len(db_queue) > 0:
-        log.debug("Writing a set of {} IDEA messages to database.".format(len(db_queue)))
+        log.debug("Writing a set of %s IDEA messages to database.", len(db_queue))
         eventdb.put(db_queue)
         db_queue.clear()
 
@@ -449,13 +449,13 @@ def receive_events(filer_path, eventdb, task_queue_writer, inactive_ip_lifetime,
             put_to_db_queue(event)
         try:
             if warden_filter and not warden_filter.should_pass(event):
-                log.debug("event {} ignored".format(event["ID"]))
+                log.debug("event %s ignored", event["ID"])
                 continue
             for src in event.get("Source", []):
                 for ipv4 in src.get("IP4", []):
                     # TODO check IP address validity
 
-                    log.debug("Updating IPv4 record {}".format(ipv4))
+                    log.debug("Updating IPv4 record %s", ipv4)
                     cat = '+'.join(event["Category"]).replace('.', '')
                     # Parse and reformat detect time
                     detect_time = parse_rfc_time(event["DetectTime"])  # Parse DetectTime
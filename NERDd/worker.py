@@ -2,31 +2,76 @@
 
 import sys
 import os
+import time
 from time import sleep
 import logging
 import threading
 import signal
+import importlib
 
-def main(cfg_file, process_index):
+# "One directory above the current file location" (where "common" is)
+_PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-    ################################################
-    # Initialize logging mechanism
-    
-    LOGFORMAT = "%(asctime)-15s,%(threadName)s,%(name)s,[%(levelname)s] %(message)s"
-    LOGDATEFORMAT = "%Y-%m-%dT%H:%M:%S"
-    
+# Plug-in modules which can be enabled in config ('enabled_modules'):
+# name -> (python module, class name)
+# Modules are instantiated in the order they are listed in config.
+MODULE_REGISTRY = {
+    'update_planner': ('modules.update_planner', 'UpdatePlanner'),
+    'cleaner': ('modules.cleaner', 'Cleaner'),
+    'event_counter': ('modules.event_counter', 'EventCounter'),
+    'dns': ('modules.dns', 'DNSResolver'),
+    'geolocation': ('modules.geolocation', 'Geolocation'),
+    'whois': ('modules.whois', 'WhoIS'),
+    'dnsbl': ('modules.dnsbl', 'DNSBLResolver'),
+    'redis_bl': ('modules.redis_bl', 'RedisBlacklist'),
+    'shodan': ('modules.shodan', 'Shodan'),
+    'eml_asn_rank': ('modules.eml_asn_rank', 'EML_ASN_rank'),
+    'reputation': ('modules.reputation', 'Reputation'),
+    'hostname': ('modules.hostname', 'HostnameClass'),
+    'caida_as_class': ('modules.caida_as_class', 'CaidaASclass'),
+    'bgp_rank': ('modules.bgp_rank', 'CIRCL_BGPRank'),
+    'event_type_counter': ('modules.event_type_counter', 'EventTypeCounter'),
+    'tags': ('modules.tags', 'Tags'),
+    'passive_dns': ('modules.passive_dns', 'PassiveDNSResolver'),
+    'fmp': ('modules.fmp', 'FMP'),
+    'reserved_ip': ('modules.reserved_ip', 'ReservedIPTags'),
+    'ttl_updater': ('modules.ttl_updater', 'TTLUpdater'),
+    'dshield': ('modules.dshield', 'DShield'),
+}
+
+# Modules used when 'enabled_modules' is not present in config
+DEFAULT_MODULES = [name for name in MODULE_REGISTRY if name != 'passive_dns']
+
+# Merged config generated by scripts/compile_config.py (used if up to date)
+COMPILED_CONFIG_FILE = '/var/cache/nerd/config_compiled.py'
+
+################################################
+# Initialize logging mechanism
+# (only once per process, when the module is imported)
+
+LOGFORMAT = "%(asctime)-15s,%(threadName)s,%(name)s,[%(levelname)s] %(message)s"
+LOGDATEFORMAT = "%Y-%m-%dT%H:%M:%SZ" # UTC (see below)
+
+if not logging.getLogger().handlers:
     logging.basicConfig(level=logging.INFO, format=LOGFORMAT, datefmt=LOGDATEFORMAT)
-    log = logging.getLogger()
-    
+    # Timestamps are in UTC (avoids timezone lookups for each log record)
+    logging.getLogger().handlers[0].formatter.converter = time.gmtime
+
     # Disable INFO and DEBUG messages from requests.urllib3 library, wihch is used by some modules
     logging.getLogger("requests").setLevel(logging.WARNING)
     logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+
+def main(cfg_file, process_index):
+    log = logging.getLogger()
     
     ################################################
     # Load core components
     
     # Add to path the "one directory above the current file location" to find modules from "common"
-    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')))
+    # (appended, so standard modules are still found first)
+    if _PARENT_DIR not in sys.path:
+        sys.path.append(_PARENT_DIR)
     
     import common.config
     import common.eventdb_mentat
@@ -37,16 +82,21 @@ def main(cfg_file, process_index):
     ################################################
     # Load configuration
     
-    # Read NERDd-specific config (nerdd.yml)
-    log.debug("Loading config file {}".format(cfg_file))
-    config = common.config.read_config(cfg_file)
-
     config_base_path = os.path.dirname(os.path.abspath(cfg_file))
 
-    # Read common config (nerd.cfg) and combine them together
-    common_cfg_file = os.path.join(config_base_path, config.get('common_config'))
-    log.debug("Loading config file {}".format(common_cfg_file))
-    config.update(common.config.read_config(common_cfg_file))
+    # Use the compiled config (see scripts/compile_config.py) if it's up to date
+    config = common.config.load_compiled_config(COMPILED_CONFIG_FILE, cfg_file)
+    if config is not None:
+        log.debug("Loaded compiled config %s", COMPILED_CONFIG_FILE)
+    else:
+        # Read NERDd-specific config (nerdd.yml)
+        log.debug("Loading config file %s", cfg_file)
+        config = common.config.read_config(cfg_file)
+
+        # Read common config (nerd.cfg) and combine them together
+        common_cfg_file = os.path.join(config_base_path, config.get('common_config'))
+        log.debug("Loading config file %s", common_cfg_file)
+        config.update(common.config.read_config(common_cfg_file))
 
 
     # Get number of processes from config
@@ -56,18 +106,18 @@ def main(cfg_file, process_index):
     assert (isinstance(process_index, int) and process_index >= 0), "Process index can't be negative"
     assert (process_index < num_processes), "Process index must be less than total number of processes"
 
-    log.info("***** NERD worker {}/{} start *****".format(process_index, num_processes))
+    log.info("***** NERD worker %s/%s start *****", process_index, num_processes)
 
     ################################################
     # Create instances of core components
     # Save them to "g" ("global") module so they can be easily accessed from everywhere
     
     import g
-    g.config = config
+    g.config = common.config.FrozenConfig(config)
     g.config_base_path = config_base_path
     g.scheduler = core.scheduler.Scheduler()
-    g.db = core.mongodb.MongoEntityDatabase(config)
-    g.um = core.update_manager.UpdateManager(config, g.db, process_index, num_processes)
+    g.db = core.mongodb.MongoEntityDatabase(g.config)
+    g.um = core.update_manager.UpdateManager(g.config, g.db, process_index, num_processes)
     
     # EventDB may be local PSQL (default), external Mentat instance or None
     # (commented out, it's currently only used in warden_receiver, which not a part of worker)
@@ -78,79 +128,31 @@ def main(cfg_file, process_index):
     # elif EVENTDB_TYPE == 'mentat':
     #     import common.eventdb_mentat
     #     g.eventdb = common.eventdb_mentat.MentatEventDBProxy(config)
-    # else:
-    #     class DummyEventDB:
-    #         def get(*args, **kwargs):
-    #             return []
-    #         def put(*args, **kwargs):
-    #             return None
-    #     g.eventdb = DummyEventDB()
-    #     log.error("Unknown 'eventdb' configured, events won't be stored")
 
     
     ################################################
     # Load all plug-in modules
     # (all modules can now use core components in "g")
     
-    # TODO load all modules automatically (or just modules specified in config)
-    import modules.update_planner
-    import modules.cleaner
-    import modules.dns
-    import modules.geolocation
-    import modules.dnsbl
-    import modules.redis_bl
-    import modules.shodan
-    import modules.eml_asn_rank
-    import modules.event_counter
-    import modules.hostname
-    import modules.caida_as_class
-    import modules.bgp_rank
-    import modules.event_type_counter
-    import modules.tags
-    import modules.reputation
-    import modules.whois
-    #import modules.passive_dns
-    import modules.fmp
-    import modules.reserved_ip
-    import modules.dshield
-    import modules.ttl_updater
-    
-    # Instantiate modules
-    # TODO create all modules automatically (loop over all modules.* and find all objects derived from NERDModule)
-    #  or take if from configuration
-    module_list = [
-        modules.update_planner.UpdatePlanner(),
-        modules.cleaner.Cleaner(),
-        modules.event_counter.EventCounter(),
-        modules.dns.DNSResolver(),
-        modules.geolocation.Geolocation(),
-        modules.whois.WhoIS(),
-        modules.dnsbl.DNSBLResolver(),
-        modules.redis_bl.RedisBlacklist(),
-        modules.shodan.Shodan(),
-        modules.eml_asn_rank.EML_ASN_rank(),
-        modules.reputation.Reputation(),
-        modules.hostname.HostnameClass(),
-        modules.caida_as_class.CaidaASclass(),
-        modules.bgp_rank.CIRCL_BGPRank(),
-        modules.event_type_counter.EventTypeCounter(),
-        modules.tags.Tags(),
-        #modules.passive_dns.PassiveDNSResolver(),
-        modules.fmp.FMP(),
-        modules.reserved_ip.ReservedIPTags(),
-        modules.ttl_updater.TTLUpdater(),
-        modules.dshield.DShield()
-    ]
-    
-    
-    # Lock used to control when the program stops.
-    g.daemon_stop_lock = threading.Lock()
-    g.daemon_stop_lock.acquire()
-    
-    # Signal handler releasing the lock on SIGINT or SIGTERM
+    # Only modules enabled in config are imported, so disabled ones don't
+    # pull in their dependencies
+    module_list = []
+    for name in config.get('enabled_modules', DEFAULT_MODULES):
+        if name not in MODULE_REGISTRY:
+            raise ValueError("Unknown module '{}' in 'enabled_modules' config".format(name))
+        module_name, class_name = MODULE_REGISTRY[name]
+        log.debug("Loading module %s", module_name)
+        mod = importlib.import_module(module_name)
+        module_list.append(getattr(mod, class_name)())
+    
+    
+    # Event used to control when the program stops.
+    g.stop_event = threading.Event()
+    
+    # Signal handler setting the stop event on SIGINT or SIGTERM
     def sigint_handler(signum, frame):
-        log.debug("Signal {} received, stopping worker".format({signal.SIGINT: "SIGINT", signal.SIGTERM: "SIGTERM"}.get(signum, signum)))
-        g.daemon_stop_lock.release()
+        log.debug("Signal %s received, stopping worker", {signal.SIGINT: "SIGINT", signal.SIGTERM: "SIGTERM"}.get(signum, signum))
+        g.stop_event.set()
     signal.signal(signal.SIGINT, sigint_handler)
     signal.signal(signal.SIGTERM, sigint_handler)
     signal.signal(signal.SIGABRT, sigint_handler)
@@ -178,10 +180,9 @@ def main(cfg_file, process_index):
     g.scheduler.start()
     
     
-    # Wait until someone wants to stop the program by releasing this Lock.
+    # Wait until someone wants to stop the program by setting the stop event.
     # It may be a user by pressing Ctrl-C or some program module.
-    # (try to acquire the lock again, effectively waiting until it's released by signal handler or another thread)
-    g.daemon_stop_lock.acquire()
+    g.stop_event.wait()
     
     # yappi.stop()
     # log.info("Profiler end")
@@ -3,15 +3,21 @@ import sys
 import json
 from datetime import datetime, timedelta, timezone
 import os
+import time
+import threading
 import subprocess
 import re
 import pytz
 import ipaddress
 import struct
 import hashlib
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 import flask
-from flask import Flask, request, make_response, g, jsonify, json, flash, redirect, session, Response
+from flask import Flask, request, make_response, g, jsonify, json, flash, redirect, session, Response, render_template, stream_with_context
 from flask_pymongo import pymongo, PyMongo, ASCENDING, DESCENDING
 import pymongo.errors
 from flask_wtf import FlaskForm
@@ -20,6 +26,8 @@ from wtforms import validators, TextField, TextAreaField, FloatField, IntegerFie
 import dateutil.parser
 import jinja2
 from pymisp import ExpandedPyMISP
+from passlib.apache import HtpasswdFile
+from cachetools import TTLCache, cached
 import signal
 from ipaddress import IPv4Address, AddressValueError
 
@@ -27,7 +35,7 @@ from ipaddress import IPv4Address, AddressValueError
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')))
 import common.config
 import common.task_queue
-from common.utils import ipstr2int, int2ipstr, parse_rfc_time
+from common.utils import ipstr2int, int2ipstr, parse_ipv4
 from shodan_rpc_client import ShodanRpcClient
 
 #import db
@@ -65,9 +73,18 @@ config_bl = common.config.read_config(bl_cfg_file)
 rabbit_config = config.get('rabbitmq')
 num_processes = config.get('worker_processes')
 
-# Init Task queue
-task_queue_writer = common.task_queue.TaskQueueWriter(num_processes, rabbit_config)
-task_queue_writer.connect()
+# Task queue writer is created and connected lazily on first use, separately
+# in each thread (AMQP channels must not be shared between threads)
+_task_queue_local = threading.local()
+
+def get_task_queue_writer():
+    """Return TaskQueueWriter of the current thread (create and connect it if needed)."""
+    tqw = getattr(_task_queue_local, 'writer', None)
+    if tqw is None:
+        tqw = common.task_queue.TaskQueueWriter(num_processes, rabbit_config)
+        tqw.connect()
+        _task_queue_local.writer = tqw
+    return tqw
 
 
 # Create event database driver (according to config)
@@ -95,6 +112,11 @@ BASE_URL = config.get('base_url', '')
 
 WARDEN_DROP_PATH = os.path.join(config.get("warden_filer_path", "/data/warden_filer/warden_receiver"), "incoming")
 
+INACTIVE_IP_LIFETIME = config.get('inactive_ip_lifetime', 14) # days
+
+TZ_UTC = pytz.utc
+TZ_LOCAL = pytz.timezone('Europe/Prague') # TODO autodetect (probably better in javascript)
+
 config.testing = False
 
 userdb.init(config, cfg_dir)
@@ -109,10 +131,17 @@ app.jinja_env.trim_blocks = True
 app.jinja_env.lstrip_blocks = True
 
 # Configuration of PyMongo
-app.config['MONGO_URI'] = "mongodb://{}:{}/{}".format(
+# (connection pool is set up to keep some connections open and to fail fast
+#  when DB is overloaded or unavailable, instead of piling up waiting requests)
+app.config['MONGO_URI'] = "mongodb://{}:{}/{}?maxPoolSize={}&minPoolSize={}&maxIdleTimeMS={}&waitQueueTimeoutMS={}&serverSelectionTimeoutMS={}".format(
     config.get('mongodb.host', 'localhost'),
     config.get('mongodb.port', 27017),
-    config.get('mongodb.dbname', 'nerd')
+    config.get('mongodb.dbname', 'nerd'),
+    config.get('mongodb.max_pool_size', 200),
+    config.get('mongodb.min_pool_size', 10),
+    config.get('mongodb.max_idle_time_ms', 300000),
+    config.get('mongodb.wait_queue_timeout_ms', 5000),
+    config.get('mongodb.server_selection_timeout_ms', 3000),
 )
 
 mongo = PyMongo(app)
@@ -128,6 +157,9 @@ app.config['MAIL_DEFAULT_SENDER'] = config.get('mail.sender', 'NERD <noreply@ner
 
 mailer = Mail(app)
 
+# Send files (data_ip_rep) by web server using X-Sendfile header, if enabled
+app.config['USE_X_SENDFILE'] = config.get('x_sendfile', False)
+
 # Disable CSRF protection globally (it's OK to send search requests from anywhere)
 # FIXME: This disables it completeley, it would be better to rather disable it
 # by default but keep an option to check CSRF explicitly in selected Forms.
@@ -140,16 +172,29 @@ app.config['WTF_CSRF_ENABLED'] = False
 # ***** Jinja2 filters *****
 
 # Datetime filters
-def format_datetime(val, format="%Y-%m-%d %H:%M:%S"):
-    return val.strftime(format)
+
+# Parser instance reused by all calls of is_date/date_to_int
+_DUP = dateutil.parser.parser()
+
+# Strings not starting like a date (YYYY-MM-DD or YYYY/MM/DD) are not considered dates by is_date
+_DATE_SHAPE_RE = re.compile(r'^\d{4}[-/]\d{1,2}[-/]\d{1,2}')
+
+def format_datetime(val, format=None):
+    # isoformat is much faster than strftime, use it for the default format
+    # (only for naive datetimes, isoformat would append UTC offset otherwise)
+    if (format is None or format == "%Y-%m-%d %H:%M:%S") and val.tzinfo is None:
+        return val.isoformat(sep=' ', timespec='seconds')
+    return val.strftime(format or "%Y-%m-%d %H:%M:%S")
 
 
 def is_date(val):
     if type(val) is datetime:
         return True
     if isinstance(val, str):
+        if not _DATE_SHAPE_RE.match(val):
+            return False
         try:
-            _ = dateutil.parser.parse(timestr=val)
+            _ = _DUP.parse(val)
             return True
         except ValueError:
             return False
@@ -160,7 +205,7 @@ def date_to_int(val):
     if type(val) is datetime:
         return val.replace(tzinfo=timezone.utc).timestamp()
     if isinstance(val, str):
-        date_value = dateutil.parser.parse(timestr=val)
+        date_value = _DUP.parse(val)
         return date_value.replace(tzinfo=timezone.utc).timestamp()
 
 
@@ -182,20 +227,14 @@ def misp_distribution_id_to_str(distribution_id):
 
 def misp_sightings_to_str(sightings):
     if sightings is not None:
-        sightings_count = [0, 0, 0]
-        for sighting_record in sightings:
-            sightings_count[int(sighting_record['type'])] += 1
-        return '/'.join([str(count) for count in sightings_count])
+        types = [int(sighting_record['type']) for sighting_record in sightings]
+        return '{}/{}/{}'.format(types.count(0), types.count(1), types.count(2))
     else:
         return "0/0/0"
 
 
 def is_ip_address(value):
-    try:
-        _ = IPv4Address(value)
-        return True
-    except AddressValueError:
-        return False
+    return isinstance(value, str) and parse_ipv4(value) >= 0
 
 
 def misp_contains_ip_address(value, attrib_type, get_rest=False):
@@ -206,25 +245,42 @@ def misp_contains_ip_address(value, attrib_type, get_rest=False):
     :param get_rest: If True, then do not return IP address, but the rest of the string (except delimiter)
     :return: IP address if get_rest is False, otherwise returns the rest of the string
     """
-    if '|' in value or ':' in value:
-        try:
-            # if domain in attribute's type, the type is domain|ip, so ip is on index 1, else it is ip-src|port or
-            # ip-dst|port
-            _ = IPv4Address(value.split('|')[1] if "domain" in attrib_type else value.split('|')[0])
-            if "domain" in attrib_type:
-                return value.split('|')[1] if not get_rest else value.split('|')[0]
-            else:
-                return value.split('|')[0] if not get_rest else value.split('|')[1]
-        except AddressValueError:
-            try:
-                # ':' appears only in ip-src|port or ip-dst|port, there is position of ip address in string strict
-                _ = IPv4Address(value.split(':')[0])
-                return value.split(':')[0] if not get_rest else value.split(':')[1]
-            except AddressValueError:
-                return False
+    if '|' in value:
+        # if domain in attribute's type, the type is domain|ip, so ip is on index 1, else it is ip-src|port or
+        # ip-dst|port
+        parts = value.split('|')
+        ip_part, other_part = (parts[1], parts[0]) if "domain" in attrib_type else (parts[0], parts[1])
+        if parse_ipv4(ip_part) >= 0:
+            return other_part if get_rest else ip_part
+    if ':' in value:
+        # ':' appears only in ip-src|port or ip-dst|port, there is position of ip address in string strict
+        parts = value.split(':')
+        if parse_ipv4(parts[0]) >= 0:
+            return parts[1] if get_rest else parts[0]
     return False
 
 
+def misp_classify_ips(attributes):
+    """
+    Find IP addresses in values of a list of MISP attributes.
+
+    Each value is checked only once, so templates don't need to call
+    is_ip_address/misp_contains_ip_address repeatedly for each attribute.
+    :param attributes: list of MISP attributes (dicts)
+    :return: generator of tuples (attribute, IP address or None, rest of the value or None if value is just the IP)
+    """
+    for attrib in attributes:
+        value = attrib['value']
+        if is_ip_address(value):
+            yield attrib, value, None
+            continue
+        ip = misp_contains_ip_address(value, attrib['type'])
+        if ip:
+            yield attrib, ip, misp_contains_ip_address(value, attrib['type'], get_rest=True)
+        else:
+            yield attrib, None, None
+
+
 def misp_get_tags(tag_list):
     return [tag['name'] for tag in tag_list]
 
@@ -247,6 +303,7 @@ app.jinja_env.filters['misp_distribution_id_to_str'] = misp_distribution_id_to_s
 app.jinja_env.filters['misp_sightings_to_str'] = misp_sightings_to_str
 app.jinja_env.filters['is_ip_address'] = is_ip_address
 app.jinja_env.filters['misp_contains_ip_address'] = misp_contains_ip_address
+app.jinja_env.filters['misp_classify_ips'] = misp_classify_ips
 app.jinja_env.filters['misp_get_tags'] = misp_get_tags
 app.jinja_env.filters['misp_get_cluster_count'] = misp_get_cluster_count
 
@@ -271,10 +328,13 @@ def strip_whitespace(s):
 
 # ***** Auxiliary functions *****
 
+# Key for pseudonymization of node names (BLAKE2s key can have at most 32 bytes)
+_SECRET_KEY_BYTES = app.secret_key.encode('utf-8')[:32]
+
+@functools.lru_cache(maxsize=4096)
 def pseudonymize_node_name(name):
     """Replace Node.Name (detector ID) by a hash with secret key"""
-    h = hashlib.md5((app.secret_key + name).encode('utf-8'))
-    return 'node.' + h.hexdigest()[:6]
+    return 'node.' + hashlib.blake2s(name.encode('utf-8'), key=_SECRET_KEY_BYTES, digest_size=3).hexdigest()
 
 
 # ***** Rate limiter *****
@@ -313,25 +373,28 @@ def create_login_handler(method_id, id_field, name_field, email_field, return_pa
         if id_field not in request.environ:
             flash("ERROR: Login failed - '"+id_field+"' not defined (either your IdP is not providing this field or there is a problem with server configuration).", "error")
             return redirect(return_path)
-        session['user'] = {
+        # User info is prepared in a local dict and stored to session at once
+        user = {
             'login_type': method_id,
             'id': request.environ[id_field],
         }
         # Name may be present in various fields, try all specified in the config and use the first present
+        name = None
         for field in (name_field if isinstance(name_field, list) else ([name_field] if name_field else [])):
             # Name may be a combination of more fields, specified using "+" symbol (e.g. )
             if "+" in field and all(f in request.environ for f in field.split('+')):
-                session['user']['name'] = " ".join(map(lambda f: request.environ[f], field.split('+')))
+                name = " ".join(map(lambda f: request.environ[f], field.split('+')))
                 break
             elif field in request.environ:
-                session['user']['name'] = request.environ[field]
+                name = request.environ[field]
                 break
         # Decode name from UTF-8 (Flask returns environ fields as str (which is always Unicode in Py3), but not parsed as utf-8; convert to bytes and decode)
-        if 'name' in session['user']:
-            session['user']['name'] = bytes(session['user']['name'], 'latin-1').decode('utf-8')
+        if name is not None:
+            user['name'] = name.encode('latin-1').decode('utf-8')
         # Email
         if email_field and email_field in request.environ:
-            session['user']['email'] = request.environ[email_field]
+            user['email'] = request.environ[email_field]
+        session['user'] = user
         flash("Login successful", "success")
         return redirect(return_path)
     return login_handler
@@ -378,46 +441,84 @@ def logout():
 
 # ***** Functions called for each request *****
 
-API_RESPONSE_403_NOAUTH = Response(
-    json.dumps({'err_n' : 403, 'error' : "Unauthorized (no authorization header)"}),
-    403, mimetype='application/json'
-)
-API_RESPONSE_403_TOKEN = Response(
-    json.dumps({'err_n' : 403, 'error' : "Unauthorized (invalid token)"}),
-    403, mimetype='application/json'
-)
-API_RESPONSE_403 = Response(
-    json.dumps({'err_n' : 403, 'error' : "Unauthorized (not authorized to use this endpoint)"}),
-    403, mimetype='application/json'
-)
+# Bodies of API error responses are serialized only once, but a new Response
+# object is created for each request (Response objects are mutable, so they
+# shouldn't be shared between requests)
+_ERR_403_NOAUTH_BYTES = json.dumps({'err_n' : 403, 'error' : "Unauthorized (no authorization header)"}).encode('utf-8')
+_ERR_403_TOKEN_BYTES = json.dumps({'err_n' : 403, 'error' : "Unauthorized (invalid token)"}).encode('utf-8')
+_ERR_403_BYTES = json.dumps({'err_n' : 403, 'error' : "Unauthorized (not authorized to use this endpoint)"}).encode('utf-8')
+
+def _resp_403_noauth():
+    return Response(_ERR_403_NOAUTH_BYTES, 403, mimetype='application/json')
+
+def _resp_403_token():
+    return Response(_ERR_403_TOKEN_BYTES, 403, mimetype='application/json')
+
+def _resp_403():
+    return Response(_ERR_403_BYTES, 403, mimetype='application/json')
+
+# The same for other common API errors
+_ERR_400_BAD_IP_BYTES = json.dumps({'err_n': 400, 'error': 'Bad IP address'}).encode('utf-8')
+_ERR_400_BAD_PARAMS_BYTES = json.dumps({'err_n': 400, 'error': 'Bad parameters'}).encode('utf-8')
+_ERR_400_BAD_PREFIX_BYTES = json.dumps({'err_n': 400, 'error': 'Bad parameters: invalid prefix'}).encode('utf-8')
+_ERR_400_SHORT_PREFIX_BYTES = json.dumps({'err_n': 400, 'error': 'Bad parameters: the shortest supported prefix is /16'}).encode('utf-8')
+_ERR_503_DB_BYTES = json.dumps({'err_n': 503, 'error': 'Database connection error'}).encode('utf-8')
+
+def _resp_400(body):
+    return Response(body, 400, mimetype='application/json')
+
+def _resp_503_db():
+    return Response(_ERR_503_DB_BYTES, 503, mimetype='application/json')
+
+@functools.lru_cache(maxsize=64)
+def _err_bad_output_bytes(output):
+    return json.dumps({'err_n': 400, 'error': 'Unrecognized value of output parameter: ' + output}).encode('utf-8')
+
+
+# Use orjson (much faster than standard json module) to serialize API responses
+# (and parse JSON from backend services), if available
+try:
+    import orjson
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    _json_dumps = json.dumps
+    _json_loads = json.loads
+
+def jresp(data, status=200):
+    """Return Response with data serialized to JSON"""
+    return Response(_json_dumps(data), status, mimetype='application/json')
+
 
+# Endpoints (names of view functions) which don't require authentication (used for performance testing)
+_TEST_ENDPOINTS = frozenset(['get_ip_rep_test'])
 
 @app.before_request
 def store_user_info():
     """Store user info to 'g' (request-wide global variable)"""
-    if request.path.endswith("/test"):
+    if request.endpoint in _TEST_ENDPOINTS:
         return
 
     if request.path.startswith("/api/v1/"):
         # API authentication using token
         auth = request.headers.get("Authorization")
         if not auth:
-            return API_RESPONSE_403_NOAUTH
+            return _resp_403_noauth()
 
         # Extract token from Authorization header. Two formats may be used:
         #   Authorization: asdf1234qwer
         #   Authorization: token asdf1234qwer
-        vals = auth.split()
-        if len(vals) == 1:
-            token = vals[0]
-        elif len(vals) == 2 and vals[0] == "token":
-            token = vals[1]
-        else:
-            return API_RESPONSE_403_TOKEN
+        # (any whitespace may be used as a separator, only the first word is split off)
+        parts = auth.split(None, 1)
+        if len(parts) == 2 and parts[0] == "token":
+            parts = parts[1].split(None, 1)
+        if len(parts) != 1:
+            return _resp_403_token()
+        token = parts[0]
 
         g.user, g.ac = authenticate_with_token(token)
         if not g.user:
-            return API_RESPONSE_403_TOKEN
+            return _resp_403_token()
 
     else:
         # Normal authentication using session cookie
@@ -431,7 +532,7 @@ def exceeded_rate_limit(user_id):
             'err_n': 429,
             'error': "Too many requests",
         }
-        return Response(json.dumps(err), 429, mimetype='application/json')
+        return jresp(err, 429)
     else:
         # Web -> return HTML with more information
         bs, tps = rate_limiter.get_user_params(user_id)
@@ -450,12 +551,15 @@ def get_user_id():
         return 'ip:' + request.remote_addr
 
 
+# Paths (prefixes) not counted by rate-limiter
+_RATE_LIMIT_SKIP_PREFIXES = ("/static/", "/login/")
+
 @app.before_request
 def rate_limit():
     """Check if user hasn't exceeded its rate-limit"""
     try:
         # Ignore requests in some paths
-        if request.path.startswith("/static/") or request.path.startswith("/login/") or request.path == "/logout":
+        if request.path.startswith(_RATE_LIMIT_SKIP_PREFIXES) or request.path == "/logout":
             return None
         user_id = get_user_id()
         # TODO set different cost for some endpoints
@@ -479,10 +583,11 @@ def add_user_header(resp):
     return resp
 
 
-# ***** Override render_template to always include some variables *****
+# ***** Variables always available in templates *****
 
-def render_template(template, **kwargs):
-    return flask.render_template(template, config=config, config_tags=config_tags['tags'], userdb=userdb, user=g.user, ac=g.ac, **kwargs)
+@app.context_processor
+def inject_template_vars():
+    return dict(config=config, config_tags=config_tags['tags'], userdb=userdb, user=g.user, ac=g.ac)
 
 
 # ***** Main page *****
@@ -534,7 +639,7 @@ def noaccount():
         mailer.send(msg)
         request_sent = True
         
-    return render_template('noaccount.html', **locals())
+    return render_template('noaccount.html', form=form, request_sent=request_sent)
 
 
 # ***** Account info & password change *****
@@ -567,6 +672,8 @@ def account_info():
         token['value'] = g.user['api_token']
         token['status'] = 1
 
+    passwd_form = None # Only shown for local accounts
+
     # Handler for /account/set_password
     if request.endpoint == 'set_password':
         if g.user['login_type'] != 'local':
@@ -575,30 +682,17 @@ def account_info():
         if passwd_form.validate():
             htpasswd_file = os.path.join(cfg_dir, config.get('login.methods.local.htpasswd_file', '.htpasswd'))
             try:
-                # Verify old password
-                cmd = ['htpasswd', '-v', '-i', htpasswd_file, g.user['id']]
-                p = subprocess.Popen(cmd, stdin=subprocess.PIPE)#, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                p.communicate(passwd_form.old_passwd.data.encode('utf-8'))
-                if p.returncode != 0:
-                    if p.returncode == 3: # Bad password
-                        flash('ERROR: Bad password', 'error')
-                        return render_template('account_info.html', **locals())
-                    else:
-                        print("ERROR: htpasswd check error '{}': retcode: {}".format(' '.join(cmd), p.returncode), file=sys.stderr)
-                        return make_response('ERROR: Cannot change password: error '+str(p.returncode),  'error')
-                
-                # Set new password
-                # (-i: read password from stdin, -B: use bcrypt, -C: bcrypt cost factor (12 should be quite secure and takes approx. 0.3s on my server)
-                cmd = ['htpasswd', '-i', '-B', '-C', '12', htpasswd_file, g.user['id']]
-                p = subprocess.Popen(cmd, stdin=subprocess.PIPE)#, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                p.communicate(passwd_form.new_passwd.data.encode('utf-8'))
-                if p.returncode != 0:
-                    print("ERROR: htpasswd set error '{}': retcode: {}".format(' '.join(cmd), p.returncode), file=sys.stderr)
-                    return make_response('ERROR: Cannot change password: error '+str(p.returncode),  'error')
-            except OSError as e:
-                p.kill()
-                print("ERROR: htpasswd OSError '{}': {}".format(' '.join(cmd), str(e)), file=sys.stderr)
-                return make_response('ERROR: Cannot change password: OSError.', 'error')
+                ht = HtpasswdFile(htpasswd_file, default_scheme='bcrypt')
+                # Verify old password (returns None if user is not in the file)
+                if not ht.check_password(g.user['id'], passwd_form.old_passwd.data):
+                    flash('ERROR: Bad password', 'error')
+                    return render_template('account_info.html', token=token, passwd_form=passwd_form)
+                # Set new password (bcrypt with cost factor 12 (passlib's default), should be quite secure and takes approx. 0.3s)
+                ht.set_password(g.user['id'], passwd_form.new_passwd.data)
+                ht.save()
+            except (OSError, ValueError) as e:
+                print("ERROR: Can't change password in '{}': {}".format(htpasswd_file, str(e)), file=sys.stderr)
+                return make_response('ERROR: Cannot change password: ' + type(e).__name__, 'error')
             
             # If we got there, password was successfully changed
             flash('Password changed. Please, <b><a href="'+BASE_URL+'/logout">log out</a></b> and then log back in using the new password.', 'safe success')
@@ -611,7 +705,7 @@ def account_info():
         if g.user['login_type'] == 'local':
             passwd_form = PasswordChangeForm()
     
-    return render_template('account_info.html', **locals())
+    return render_template('account_info.html', token=token, passwd_form=passwd_form)
 
 
 # ***** Admin's selection of effective groups *****
@@ -639,40 +733,119 @@ def set_effective_groups():
 
 # ***** List of IP addresses *****
 
+# Config is loaded only once at startup, so results of the following functions
+# never change and they can be cached (tuples are returned so the cached value
+# can't be modified by accident)
+
+@functools.lru_cache(maxsize=1)
 def get_ip_blacklists():
-    # Get the list of all configured IP blacklists. Return array of (id, name).
+    # Get the list of all configured IP blacklists. Return tuple of (id, name).
     # DNSBL (IP only)
     blacklists = [(bl_name, bl_name) for bl_group in config.get('dnsbl.blacklists', []) for bl_name in bl_group[2].values()]
     # Blacklists cached in Redis (IP and prefix)
     blacklists += [(bl[0], bl[1]) for bl in config_bl.get('iplists', [])]
     blacklists += [(bl[0], bl[1]) for bl in config_bl.get('prefixiplists', [])]
     blacklists.sort()
-    return blacklists
+    return tuple(blacklists)
 
+@functools.lru_cache(maxsize=1)
 def get_domain_blacklists():
-    # Get the list of all configured domain blacklists. Return array of (id, name).
+    # Get the list of all configured domain blacklists. Return tuple of (id, name).
     blacklists = [(bl[0], bl[1]) for bl in config_bl.get('domainlists', [])]
     blacklists.sort()
-    return blacklists
+    return tuple(blacklists)
 
+@functools.lru_cache(maxsize=1)
 def get_tags():
-    """Get list of all configured tags (list of IDs and names)"""
+    """Get list of all configured tags (tuple of IDs and names)"""
     tags = [ (tag_id, tag_param.get('name', tag_id)) for tag_id, tag_param in config_tags.get('tags', {}).items()]
     tags.sort()    
-    return tags
+    return tuple(tags)
+
+# Cache of values for dynamically loaded choices of IPFilterForm: key -> (value, expiration time)
+_choices_cache = {}
+CHOICES_CACHE_TTL = 60 # seconds
+
+def _get_cached(key, loader):
+    """Return value for key from _choices_cache, call loader() to get it if it's missing or expired."""
+    now = time.monotonic()
+    item = _choices_cache.get(key)
+    if item is None or item[1] < now:
+        item = (loader(), now + CHOICES_CACHE_TTL)
+        _choices_cache[key] = item
+    return item[0]
+
+def _load_cat_choices():
+    return [(item['_id'], '{} ({})'.format(item['_id'], int(item['n']))) for item in mongo.db.n_ip_by_cat.find().sort('_id') if item['_id']]
+
+def _load_node_choices():
+    return [(item['_id'], '{} ({})'.format(item['_id'], int(item['n']))) for item in mongo.db.n_ip_by_node.find().sort('_id') if item['_id']]
+
+def _load_blacklist_choices():
+    # Number of occurrences for blacklists (list of blacklists is taken from configuration)
+    bl_name2num = {item['_id']: int(item['n']) for item in mongo.db.n_ip_by_bl.find()}
+    dbl_name2num = {item['_id']: int(item['n']) for item in mongo.db.n_ip_by_dbl.find()}
+    bl_choices = [('i:'+id, '[IP] {} ({})'.format(name, bl_name2num.get(id, 0))) for id,name in get_ip_blacklists()]
+    dbl_choices = [('d:'+id, '[dom] {} ({})'.format(name, dbl_name2num.get(id, 0))) for id,name in get_domain_blacklists()]
+    return bl_choices + dbl_choices
+
+_PREFIXLEN_RE = re.compile(r'[0-9]+')
+
+def parse_prefixlen(s):
+    """
+    Parse IPv4 prefix length, return it as int or -1 if it's not valid.
+
+    Like in ipaddress.IPv4Network, the length may be given as a number, a netmask
+    (e.g. '255.255.0.0') or a hostmask (e.g. '0.0.255.255').
+    """
+    if _PREFIXLEN_RE.fullmatch(s):
+        n = int(s)
+        return n if n <= 32 else -1
+    mask = parse_ipv4(s)
+    if mask < 0:
+        return -1
+    for netmask in (mask, mask ^ 0xffffffff): # try as netmask, then as hostmask
+        host = netmask ^ 0xffffffff
+        if host & (host + 1) == 0: # contiguous ones followed by zeros
+            return 32 - host.bit_length()
+    return -1
+
+def prefix_range_end(s):
+    """
+    Return the smallest string greater than all strings with prefix s (None if there is no such string)
+
+    Trailing characters with the maximal code point can't be incremented, so they are removed.
+    Surrogates (which can't be encoded into BSON) are skipped.
+    """
+    s = s.rstrip('\U0010ffff')
+    if not s:
+        return None
+    n = ord(s[-1]) + 1
+    if 0xd800 <= n <= 0xdfff:
+        n = 0xe000
+    return s[:-1] + chr(n)
+
+@functools.lru_cache(maxsize=1024)
+def parse_subnet(subnet):
+    """Parse IPv4 prefix, return its canonical form and first and last address as int (raise ValueError if invalid)"""
+    net = ipaddress.IPv4Network(subnet, strict=False)
+    return str(net), int(net.network_address), int(net.broadcast_address)
 
 def subnet_validator(form, field):
     try:
-        ipaddress.IPv4Network(field.data, strict=False)
+        parse_subnet(field.data)
     except ValueError:
         raise validators.ValidationError()
 
+# ASN, optionally preceded by "AS"
+_ASN_RE = re.compile(r'^(AS)?\d+$', re.IGNORECASE)
+
 class IPFilterForm(FlaskForm):
     subnet = TextField('IP prefix', [validators.Optional(), subnet_validator], filters=[strip_whitespace])
     hostname = TextField('Hostname suffix', [validators.Optional()], filters=[strip_whitespace])
     country = TextField('Country code', [validators.Optional(), validators.length(2, 2)], filters=[strip_whitespace])
     asn = TextField('ASN', [validators.Optional(),
-        validators.Regexp('^(AS)?\d+$', re.IGNORECASE,
+        validators.Regexp(_ASN_RE,
         message='Must be a number, optionally preceded by "AS".')], filters=[strip_whitespace])
     cat = SelectMultipleField('Event category', [validators.Optional()]) # Choices are set up dynamically (see below)
     cat_op = HiddenField('', default="or")
@@ -703,14 +876,10 @@ class IPFilterForm(FlaskForm):
         # Dynamically load list of Categories/Nodes and their number of occurrences
         # Collections n_ip_by_* should be periodically updated by queries run by 
         # cron (see /scripts/update_db_meta_info.js)
-        self.cat.choices = [(item['_id'], '{} ({})'.format(item['_id'], int(item['n']))) for item in mongo.db.n_ip_by_cat.find().sort('_id') if item['_id']]
-        self.node.choices = [(item['_id'], '{} ({})'.format(item['_id'], int(item['n']))) for item in mongo.db.n_ip_by_node.find().sort('_id') if item['_id']]
-        # Number of occurrences for blacklists (list of blacklists is taken from configuration)
-        bl_name2num = {item['_id']: int(item['n']) for item in mongo.db.n_ip_by_bl.find()}
-        dbl_name2num = {item['_id']: int(item['n']) for item in mongo.db.n_ip_by_dbl.find()}
-        bl_choices = [('i:'+id, '[IP] {} ({})'.format(name, bl_name2num.get(id, 0))) for id,name in get_ip_blacklists()]
-        dbl_choices = [('d:'+id, '[dom] {} ({})'.format(name, dbl_name2num.get(id, 0))) for id,name in get_domain_blacklists()]
-        self.blacklist.choices = bl_choices + dbl_choices
+        # (results are cached for a short time, see _get_cached)
+        self.cat.choices = list(_get_cached('cat', _load_cat_choices))
+        self.node.choices = list(_get_cached('node', _load_node_choices))
+        self.blacklist.choices = list(_get_cached('blacklist', _load_blacklist_choices))
 
 class IPFilterFormUnlimited(IPFilterForm):
     """Subclass of IPFilterForm with possibility to set no limit on number of results (used by API)"""
@@ -730,27 +899,33 @@ sort_mapping = {
     'ip': '_id',
 }
 
+@cached(cache=TTLCache(maxsize=4096, ttl=300), lock=threading.Lock())
+def get_asn_bgpprefs(asn):
+    """Get tuple of BGP prefixes of given ASN (or None if ASN is not in DB), results are cached for 5 minutes"""
+    asrec = mongo.db.asn.find_one({'_id': asn}, {'bgppref': 1})
+    if asrec and 'bgppref' in asrec:
+        return tuple(asrec['bgppref'])
+    return None
+
 def create_query(form):
     # Prepare 'find' part of the query
     queries = []
     if form.subnet.data:
-        subnet = ipaddress.IPv4Network(form.subnet.data, strict=False)
-        form.subnet.data = str(subnet) # Convert to canonical form (e.g. 1.2.3.4/16 -> 1.2.0.0/16)
-        subnet_start = int(subnet.network_address) # IP addresses are stored as int
-        subnet_end = int(subnet.broadcast_address)
-        queries.append( {'$and': [{'_id': {'$gte': subnet_start}}, {'_id': {'$lte': subnet_end}}]} )
+        # Convert to canonical form (e.g. 1.2.3.4/16 -> 1.2.0.0/16), IP addresses are stored as int
+        form.subnet.data, subnet_start, subnet_end = parse_subnet(form.subnet.data)
+        queries.append( {'_id': {'$gte': subnet_start, '$lte': subnet_end}} )
     if form.hostname.data:
         hn = form.hostname.data[::-1] # Hostnames are stored reversed in DB to allow search by suffix as a range search
-        hn_end = hn[:-1] + chr(ord(hn[-1])+1)
-        queries.append( {'$and': [{'hostname': {'$gte': hn}}, {'hostname': {'$lt': hn_end}}]} )
+        hn_end = prefix_range_end(hn)
+        queries.append( {'hostname': {'$gte': hn, '$lt': hn_end} if hn_end else {'$gte': hn}} )
     if form.country.data:
         queries.append( {'geo.ctry': form.country.data.upper() } )
     if form.asn.data and form.asn.data.strip():
         # ASN is not stored in IP records - get list of BGP prefixes of the ASN and filter by these
         asn = int(form.asn.data.lstrip("ASas"))
-        asrec = mongo.db.asn.find_one({'_id': asn})
-        if asrec and 'bgppref' in asrec:
-            queries.append( {'bgppref': {'$in': asrec['bgppref']}} )
+        bgpprefs = get_asn_bgpprefs(asn)
+        if bgpprefs is not None:
+            queries.append( {'bgppref': {'$in': list(bgpprefs)}} )
         else:
             queries.append( {'_id': {'$exists': False}} ) # ASN not in DB, add query which is always false to get no results
     if form.cat.data:
@@ -760,16 +935,50 @@ def create_query(form):
         op = '$and' if (form.node_op.data == "and") else '$or'
         queries.append( {op: [{'events.node': node} for node in form.node.data]} )
     if form.blacklist.data:
-        op = '$and' if (form.bl_op.data == "and") else '$or'
-        array = [{('dbl' if t == 'd' else 'bl'): {'$elemMatch': {'n': id, 'v': 1}}} for t,_,id in map(lambda s: s.partition(':'), form.blacklist.data)]
-        queries.append( {op: array} )
+        bl_ids = []
+        dbl_ids = []
+        for t,_,id in map(lambda s: s.partition(':'), form.blacklist.data):
+            (dbl_ids if t == 'd' else bl_ids).append(id)
+        if form.bl_op.data == "and":
+            array = [{'bl': {'$elemMatch': {'n': id, 'v': 1}}} for id in bl_ids] + \
+                    [{'dbl': {'$elemMatch': {'n': id, 'v': 1}}} for id in dbl_ids]
+            queries.append( {'$and': array} )
+        else:
+            # "or" - at most one condition for each type of blacklist is needed
+            array = []
+            if bl_ids:
+                array.append( {'bl': {'$elemMatch': {'n': {'$in': bl_ids}, 'v': 1}}} )
+            if dbl_ids:
+                array.append( {'dbl': {'$elemMatch': {'n': {'$in': dbl_ids}, 'v': 1}}} )
+            queries.append( {'$or': array} if len(array) > 1 else array[0] )
     if form.tag.data:
         op = '$and' if (form.tag_op.data == "and") else '$or'
         confidence = form.tag_conf.data if form.tag_conf.data else 0
         queries.append( {op: [{'$and': [{'tags.'+ tag_id: {'$exists': True}}, {'tags.'+ tag_id +'.confidence': {'$gte': confidence}}]} for tag_id in form.tag.data]} )
-    query = {'$and': queries} if queries else None
+    # Single condition doesn't need the '$and' wrapper (simpler for the query planner)
+    if len(queries) > 1:
+        query = {'$and': queries}
+    else:
+        query = queries[0] if queries else None
     return query
 
+# Fields of IP records needed by the ips.html template (other fields are not fetched from DB)
+IPS_PROJECTION = {
+    '_id': 1, 'hostname': 1, 'bgppref': 1, 'geo': 1, 'rep': 1, 'fmp': 1, 'tags': 1, 'bl': 1, 'dbl': 1,
+    'events': 1, 'events_meta': 1, 'misp_events': 1, 'last_activity': 1, 'ts_added': 1,
+    'shodan': 1, 'open_dns': 1, 'open_ntp': 1, 'open_snmp': 1,
+}
+
+def _num_misp_events_with_tlp(tlp):
+    """Aggregation expression: number of MISP events of the IP with given TLP"""
+    return {'$size': {'$filter': {'input': {'$ifNull': ['$misp_events', []]}, 'as': 'm', 'cond': {'$eq': ['$$m.tlp', tlp]}}}}
+
+# Projection for the aggregation in ips(), numbers of MISP events by TLP are computed by DB
+IPS_AGGR_PROJECTION = dict(IPS_PROJECTION,
+    _misp_white=_num_misp_events_with_tlp('white'),
+    _misp_green=_num_misp_events_with_tlp('green'),
+)
+
 @app.route('/ips')
 @app.route('/ips/')
 def ips():
@@ -782,8 +991,6 @@ def ips():
         form.tag.choices = [(tag_id, tag_name) for tag_id, tag_name in form.tag.choices if tag_id != 'misp_tlp_green']
 
     if g.ac('ipsearch') and form.validate():
-        tz_utc = pytz.utc 
-        timezone = pytz.timezone('Europe/Prague') # TODO autodetect (probably better in javascript)
         sortby = sort_mapping[form.sortby.data]
         
         try:
@@ -792,38 +999,47 @@ def ips():
             query_params = json.dumps(form.data)
         
             # Perform DB query
-            results = mongo.db.ip.find(query).limit(form.limit.data)
+            pipeline = [{'$match': query or {}}]
             if sortby != "none":
-                results.sort(sortby, 1 if form.asc.data else -1)
-            results = list(results) # Load all data now, so we are able to get number of results in template
+                pipeline.append({'$sort': {sortby: 1 if form.asc.data else -1}})
+            pipeline.append({'$limit': form.limit.data})
+            pipeline.append({'$project': IPS_AGGR_PROJECTION})
+            results = list(mongo.db.ip.aggregate(pipeline)) # Load all data now, so we are able to get number of results in template
         except pymongo.errors.ServerSelectionTimeoutError:
             results = []
             error = 'database_error'
 
-        # Convert _id from int to dotted-decimal string        
+        # Get records of all BGP prefixes and ASNs of the results (just one query for each collection)
+        pref_ids = {ip['bgppref'] for ip in results if 'bgppref' in ip}
+        prefs = {rec['_id']: rec for rec in mongo.db.bgppref.find({'_id': {'$in': list(pref_ids)}})} if pref_ids else {}
+        asn_ids = {asn for rec in prefs.values() for asn in rec.get('asn', [])}
+        asns = {}
+        for rec in (mongo.db.asn.find({'_id': {'$in': list(asn_ids)}}) if asn_ids else []):
+            if 'bgppref' not in rec:
+                continue # an inconsistence in DB (ASN without any prefix), skip it
+            del rec['bgppref']
+            asns[rec['_id']] = rec
+        # Prepare (bgppref, asn_list) pair for each prefix (shared by all IPs in the same prefix)
+        pref_info = {}
+        for pref_id, bgppref in prefs.items():
+            if 'asn' not in bgppref:
+                continue # an inconsistence in DB, it may happen temporarily
+            asn_list = [asns[i] for i in bgppref.pop('asn') if i in asns]
+            pref_info[pref_id] = (bgppref, asn_list)
+
+        show_nodenames = g.ac('nodenames')
+        show_tlp_green = g.ac('tlp-green')
+
+        # Process all results in a single pass
         for ip in results:
+            # Convert _id from int to dotted-decimal string
             ip['_id'] = int2ipstr(ip['_id'])
-        
-        for ip in results:    
-            if "bgppref" in ip:
-                asn_list = []
-                bgppref = mongo.db.bgppref.find_one({'_id':ip['bgppref']})
-                if not bgppref or 'asn' not in bgppref:
-                    continue # an inconsistence in DB, it may happen temporarily
-
-                for i in  bgppref['asn']:
-                    i = mongo.db.asn.find_one({'_id':i})
-                    if not i or 'bgppref' not in i:
-                        continue
-                    del i['bgppref']
-                    asn_list.append(i)
-
-                del bgppref['asn']
-                ip['bgppref'] = bgppref
-                ip['asn'] = asn_list
-
-        # Add metainfo about events for easier creation of event table in the template
-        for ip in results:
+
+            # Attach BGP prefix and ASN records
+            if "bgppref" in ip and ip['bgppref'] in pref_info:
+                ip['bgppref'], ip['asn'] = pref_info[ip['bgppref']]
+
+            # Add metainfo about events for easier creation of event table in the template
             events = ip.get('events', [])
             # Get sets of all dates, cats and nodes
             dates = set()
@@ -839,7 +1055,7 @@ def ips():
                 pass
 
             # Pseudonymize node names if user is not allowed to see the original names
-            if not g.ac('nodenames'):
+            if not show_nodenames:
                 nodes = [pseudonymize_node_name(name) for name in nodes]
 
             dates = sorted(dates)
@@ -854,12 +1070,13 @@ def ips():
                 ellipsis = True
             
             # Table len(dates) x len(cats) -> number
-            date_cat_table = [ [0 for _ in cats] for _ in dates ] 
+            date_idx = {date: i for i, date in enumerate(dates)}
+            cat_idx = {cat: i for i, cat in enumerate(cats)}
+            date_cat_table = [ [0] * len(cats) for _ in dates ]
             for evtrec in events:
-                try:
-                    date_cat_table[dates.index(evtrec['date'])][cats.index(evtrec['cat'])] += evtrec['n']
-                except ValueError:
-                    pass # date not found in dates because we cut it
+                i = date_idx.get(evtrec['date'])
+                if i is not None: # date may not be in dates because we cut it
+                    date_cat_table[i][cat_idx[evtrec['cat']]] += evtrec['n']
             
             # Insert ellipsis at the beginning of the table to show there are more data in older dates
             if ellipsis:
@@ -877,12 +1094,8 @@ def ips():
             }
         
             # Add number of "visible" MISP events (i.e. after filtering by TLP and user's access rights)
-            showable_misp_events = 0
-            for misp_event in ip.get('misp_events', []):
-                tlp = misp_event.get('tlp')
-                if tlp == "white" or (tlp == "green" and g.ac('tlp-green')):
-                    showable_misp_events += 1
-            ip['_showable_misp_events'] = showable_misp_events
+            misp_green = ip.pop('_misp_green', 0)
+            ip['_showable_misp_events'] = ip.pop('_misp_white', 0) + (misp_green if show_tlp_green else 0)
         
     else:
         results = None
@@ -892,15 +1105,30 @@ def ips():
     return render_template('ips.html', json=json, ctrydata=ctrydata, **locals())
 
 
+# Cache of results of ips_count: JSON of form data -> number of matching IPs
+_ips_count_cache = TTLCache(maxsize=256, ttl=60)
+_ips_count_cache_lock = threading.Lock()
+IPS_COUNT_MAX_TIME_MS = 5000
+
 @app.route('/_ips_count', methods=['POST'])
 def ips_count():
     #Excepts query as JSON encoded POST data.
     form_values = request.get_json()
     form = IPFilterForm(obj=form_values)
     if g.ac('ipsearch') and form.validate():
-        query = create_query(form)
-        #print("query: " + str(query))
-        return make_response(str(mongo.db.ip.find(query).count()))
+        key = json.dumps({k: v for k, v in form.data.items() if k != 'csrf_token'}, sort_keys=True)
+        with _ips_count_cache_lock:
+            cnt = _ips_count_cache.get(key)
+        if cnt is None:
+            query = create_query(form)
+            #print("query: " + str(query))
+            try:
+                cnt = mongo.db.ip.count_documents(query or {}, maxTimeMS=IPS_COUNT_MAX_TIME_MS)
+            except pymongo.errors.ExecutionTimeout:
+                return make_response("ERROR (timeout)")
+            with _ips_count_cache_lock:
+                _ips_count_cache[key] = cnt
+        return make_response(str(cnt))
     else:
         return make_response("ERROR")
 
@@ -931,10 +1159,11 @@ def ip(ipaddr=None):
             asn_list = []
             if ipinfo:
                 if 'bgppref' in ipinfo:
-                    bgppref = mongo.db.bgppref.find_one({'_id': ipinfo['bgppref']})
-                    if bgppref and 'asn' in bgppref:
+                    bgppref = mongo.db.bgppref.find_one({'_id': ipinfo['bgppref']}, {'asn': 1})
+                    if bgppref and bgppref.get('asn'):
+                        asns = {asn['_id']: asn for asn in mongo.db.asn.find({'_id': {'$in': bgppref['asn']}})}
                         for asn in bgppref['asn']:
-                            asn = mongo.db.asn.find_one({'_id': asn})
+                            asn = asns.get(asn)
                             if not asn or 'bgppref' not in asn:
                                 continue
                             #del asn['bgppref']
@@ -967,7 +1196,7 @@ def ajax_request_ip_data(ipaddr):
         return exceeded_rate_limit(user_id)
 
     record_ttl = datetime.utcnow() + timedelta(hours=3)
-    task_queue_writer.put_task('ip', ipaddr, [('set', '_ttl.web', record_ttl)], priority=True)
+    get_task_queue_writer().put_task('ip', ipaddr, [('set', '_ttl.web', record_ttl)], priority=True)
     return make_response("OK")
 
 
@@ -976,7 +1205,7 @@ def ajax_is_ip_prepared(ipaddr):
     try:
         ipaddress.IPv4Address(ipaddr)
     except AddressValueError:
-        return Response(json.dumps({'err_n' : 400, 'error' : "Invalid IP address"}), 400, mimetype='application/json')
+        return jresp({'err_n' : 400, 'error' : "Invalid IP address"}, 400)
 
     ipnum = ipstr2int(ipaddr)
     ipinfo = mongo.db.ip.find_one({'_id': ipnum})
@@ -998,38 +1227,23 @@ def ajax_ip_events(ipaddr):
     events = []
     error = None
     
-    # Get only data from last 14 days
-    ip_lifetime = config.get('inactive_ip_lifetime', 14)
-    from_date = datetime.utcnow() - timedelta(days=ip_lifetime)
+    # Get only data from last 14 days (by default)
+    from_date = datetime.utcnow() - timedelta(days=INACTIVE_IP_LIFETIME)
     
+    # "_duration" is computed for each event by the event DB layer
     # PSQL database
     if EVENTDB_TYPE == 'psql':
-        events = eventdb.get('ip', ipaddr, limit=100, dt_from=from_date)
+        events = eventdb.get('ip', ipaddr, limit=100, dt_from=from_date, with_duration=True)
     # Mentat
     elif EVENTDB_TYPE == 'mentat':
         try:
-            events = eventdb.get('ip', ipaddr, limit=100, dt_from=from_date)
+            events = eventdb.get('ip', ipaddr, limit=100, dt_from=from_date, with_duration=True)
         except (common.eventdb_mentat.NotConfigured,common.eventdb_mentat.GatewayError) as e:
             error = 'ERROR: ' + str(e)
     # no database to read events from
     else:
         error = 'Event database disabled'
 
-    # Compute "duration" for each event
-    for event in events:
-        start = end = None
-        try:
-            if event.get("EventTime") and event.get("CeaseTime"):
-                start = parse_rfc_time(event['EventTime'])
-                end = parse_rfc_time(event['CeaseTime'])
-            elif event.get("WinStartTime") and event.get("WinEndTime"):
-                start = parse_rfc_time(event['WinStartTime'])
-                end = parse_rfc_time(event['WinEndTime'])
-        except ValueError:
-            pass # Invalid format of some time specification
-        if start and end:
-            event["_duration"] = (end - start).total_seconds()
-
     num_events = str(len(events))
     if len(events) >= 100:
         num_events = "&ge;100, only latest 100 shown"
@@ -1066,7 +1280,7 @@ def misp_event(event_id=None):
 # ***** Detailed info about individual AS *****
 
 class SingleASForm(FlaskForm):
-    asn = TextField('AS number', [validators.Regexp('^(AS)?\d+$', re.IGNORECASE,
+    asn = TextField('AS number', [validators.Regexp(_ASN_RE,
             message='Must be a number, optionally preceded by "AS".')])
 
 
@@ -1112,7 +1326,7 @@ def ipblock(ipblock=None):
         title = ipblock
         rec = mongo.db.ipblock.find_one({'_id': ipblock})
         if rec is not None:
-            cursor = mongo.db.ip.find({'ipblock': ipblock}, {'_id': 1})
+            cursor = mongo.db.ip.find({'ipblock': ipblock}, {'_id': 1}).batch_size(10000)
             rec['ips'] = []
             if cursor is not None:
                 for val in cursor:
@@ -1161,7 +1375,7 @@ def bgppref(bgppref=None):
         title = bgppref
         rec = mongo.db.bgppref.find_one({'_id': bgppref})
         if rec is not None:
-            cursor = mongo.db.ip.find({'bgppref': bgppref}, {'_id': 1})
+            cursor = mongo.db.ip.find({'bgppref': bgppref}, {'_id': 1}).batch_size(10000)
             rec['ips'] = []
             for val in cursor:
                 rec['ips'].append(int2ipstr(val['_id']))
@@ -1171,14 +1385,16 @@ def bgppref(bgppref=None):
 
 # ***** NERD status information *****
 
-@app.route('/status')
-def get_status():
-    cnt_ip = mongo.db.ip.count()
-    cnt_bgppref = mongo.db.bgppref.count()
-    cnt_asn = mongo.db.asn.count()
-    cnt_ipblock = mongo.db.ipblock.count()
-    cnt_org = mongo.db.org.count()
-    idea_queue_len = len(os.listdir(WARDEN_DROP_PATH))
+@cached(cache=TTLCache(maxsize=1, ttl=30), lock=threading.Lock())
+def get_status_data():
+    """Gather data for /status (cached for 30 seconds, since it's quite expensive and may be polled often)"""
+    cnt_ip = mongo.db.ip.estimated_document_count()
+    cnt_bgppref = mongo.db.bgppref.estimated_document_count()
+    cnt_asn = mongo.db.asn.estimated_document_count()
+    cnt_ipblock = mongo.db.ipblock.estimated_document_count()
+    cnt_org = mongo.db.org.estimated_document_count()
+    with os.scandir(WARDEN_DROP_PATH) as it:
+        idea_queue_len = sum(1 for _ in it)
     
     if "upd_cnt_file" in config:
         try:
@@ -1200,7 +1416,7 @@ def get_status():
     except Exception as e:
         disk_usage = "(error) " + str(e)
     
-    return jsonify(
+    return dict(
         cnt_ip=cnt_ip,
         cnt_bgppref=cnt_bgppref,
         cnt_asn=cnt_asn,
@@ -1212,10 +1428,39 @@ def get_status():
         disk_usage=disk_usage
     )
 
+@app.route('/status')
+def get_status():
+    return jsonify(**get_status_data())
+
 
 # ***** Plain-text list of IP addresses *****
 # (gets the same parameters as /ips/)
 
+def stream_ip_list(first, results):
+    """
+    Return Response streaming plain-text list of IP addresses, one per line.
+
+    'first' is the first record (or None if there are no results), which should be
+    fetched by the caller (so DB errors can be handled there), 'results' is
+    the cursor with the rest of the records. Only '_id' of the records is used.
+    """
+    if first is None:
+        return Response('', 200, mimetype='text/plain')
+
+    # Stream the list as the results are read from the cursor (in chunks of 1000 lines)
+    def generate():
+        lines = []
+        for res in itertools.chain((first,), results):
+            lines.append(int2ipstr(res['_id']))
+            if len(lines) >= 1000:
+                lines.append('')
+                yield '\n'.join(lines)
+                lines = []
+        if lines:
+            lines.append('')
+            yield '\n'.join(lines)
+    return Response(stream_with_context(generate()), 200, mimetype='text/plain')
+
 @app.route('/iplist')
 @app.route('/iplist/')
 def iplist():
@@ -1234,12 +1479,14 @@ def iplist():
     
     try:
         # Perform DB query
-        results = mongo.db.ip.find(query, {'_id': 1}).limit(form.limit.data)
+        results = mongo.db.ip.find(query, {'_id': 1}).limit(form.limit.data).batch_size(5000)
         if sortby != "none":
             results.sort(sortby, 1 if form.asc.data else -1)
-        return Response(''.join(int2ipstr(res['_id'])+'\n' for res in results), 200, mimetype='text/plain')
+        # Get the first result now, so connection errors are caught here (and not during streaming)
+        first = next(results, None)
     except pymongo.errors.ServerSelectionTimeoutError:
         return Response('ERROR: Database connection error', 503, mimetype='text/plain')
+    return stream_ip_list(first, results)
 
 
 # ******************** Map ********************
@@ -1275,7 +1522,7 @@ def data_ip_rep():
 def api_user_info():
     """Return account information if user is successfully authenticated"""
     if not g.ac('ipsearch'):
-        return API_RESPONSE_403
+        return _resp_403()
     data = {
         'userid': g.user.get('fullid'),
 #        'name': g.user.get('name', ''),
@@ -1285,8 +1532,18 @@ def api_user_info():
         'rate-limit-bucket-size': g.user.get('rl-bs') or rate_limiter.def_bucket_size,
         'rate-limit-tokens-per-sec': g.user.get('rl-tps') or rate_limiter.def_tokens_per_sec,
     }
-    return Response(json.dumps(data), 200, mimetype='application/json')
+    return jresp(data)
+
 
+# Max number of the most recent blacklist detections (bl.h) returned in full info
+BL_HISTORY_LIMIT = 20
+
+# Fields of IP records needed by get_basic_info_dic() and get_full_info(), respectively
+BASIC_INFO_PROJECTION = {'rep': 1, 'fmp': 1, 'hostname': 1, 'bgppref': 1, 'ipblock': 1, 'geo': 1, 'bl.n': 1, 'tags': 1}
+FULL_INFO_PROJECTION = {
+    'rep': 1, 'fmp': 1, 'hostname': 1, 'bgppref': 1, 'ipblock': 1, 'geo': 1, 'bl': 1,
+    'ts_added': 1, 'ts_last_update': 1, 'last_activity': 1, 'events': 1, 'events_meta': 1, 'misp_events': 1,
+}
 
 def get_ip_info(ipaddr, full):
     data = {
@@ -1296,23 +1553,20 @@ def get_ip_info(ipaddr, full):
     }
 
     if not ipaddr:
-        return False, Response(json.dumps(data), 400, mimetype='application/json')
+        return False, jresp(data, 400)
 
     form = SingleIPForm(ip=ipaddr)
     if not form.validate():
         data['error'] = "Bad IP address"
-        return False, Response(json.dumps(data), 400, mimetype='application/json')
+        return False, jresp(data, 400)
 
     ipint = ipstr2int(form.ip.data) # Convert string IP to int
 
-    if full:
-        ipinfo = mongo.db.ip.find_one({'_id':ipint})
-    else:
-        ipinfo = mongo.db.ip.find_one({'_id':ipint}, {'rep': 1, 'fmp': 1, 'hostname': 1, 'bgppref': 1, 'ipblock': 1, 'geo': 1, 'bl': 1, 'tags': 1})
+    ipinfo = mongo.db.ip.find_one({'_id':ipint}, FULL_INFO_PROJECTION if full else BASIC_INFO_PROJECTION)
     if not ipinfo:
         data['err_n'] = 404
         data['error'] = "IP address not found"
-        return False, Response(json.dumps(data), 404, mimetype='application/json')
+        return False, jresp(data, 404)
 
     ipinfo['_id'] = int2ipstr(ipinfo['_id']) # Convert int IP to string
 
@@ -1324,14 +1578,56 @@ def conv_dates(rec):
     """Convert datetimes in a record to YYYY-MM-DDTMM:HH:SS string"""
     for key in ('ts_added', 'ts_last_update'):
         if key in rec and isinstance(rec[key], datetime):
-            rec[key] = rec[key].strftime("%Y-%m-%dT%H:%M:%S")
+            rec[key] = rec[key].isoformat(timespec='seconds')
+
+
+# Thread pool for parallel DB queries in attach_whois_data (PyMongo client is thread-safe)
+_whois_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='whois')
 
+def get_bgppref_asns(bgpprefs):
+    """Load records of given BGP prefixes (only 'asn' field) by one query, return dict bgppref -> record"""
+    if not bgpprefs:
+        return {}
+    return {rec['_id']: rec for rec in mongo.db.bgppref.find({'_id': {'$in': list(bgpprefs)}}, {'asn': 1}).batch_size(len(bgpprefs))}
+
+def load_whois_records(ipinfos):
+    """
+    Load records of BGP prefixes, ASNs, IP blocks and Orgs related to all given IP records (one query per collection).
 
-def attach_whois_data(ipinfo, full):
+    Return dict collection -> {id -> record}, which can be passed to attach_whois_data as whois_recs.
+    """
+    def load(collection, ids):
+        ids = list(ids)
+        if not ids:
+            return {}
+        return {rec['_id']: rec for rec in mongo.db[collection].find({'_id': {'$in': ids}}).batch_size(len(ids))}
+    bgppref_recs = load('bgppref', {ipinfo['bgppref'] for ipinfo in ipinfos if 'bgppref' in ipinfo})
+    ipblock_recs = load('ipblock', {ipinfo['ipblock'] for ipinfo in ipinfos if 'ipblock' in ipinfo})
+    asn_recs = load('asn', {asn for rec in bgppref_recs.values() for asn in rec.get('asn', [])})
+    org_recs = load('org', {rec['org'] for rec in itertools.chain(asn_recs.values(), ipblock_recs.values()) if 'org' in rec})
+    return {'bgppref': bgppref_recs, 'asn': asn_recs, 'ipblock': ipblock_recs, 'org': org_recs}
+
+def _copy_rec(rec):
+    """Shallow copy of a preloaded record (records are modified when attached, but only at the top level)"""
+    return dict(rec) if rec is not None else None
+
+def attach_whois_data(ipinfo, full, bgppref_recs=None, whois_recs=None):
+    """
+    Attach data about related BGP prefix, ASNs, IP block and Org to IP record.
+
+    If full is False, only ASN number(s) are attached. In that case, records of BGP
+    prefixes may be passed in bgppref_recs (as returned by get_bgppref_asns), so
+    no DB query is needed (useful when processing many IPs).
+    Similarly, if full is True, all the needed records may be passed in whois_recs
+    (as returned by load_whois_records).
+    """
     if not full:
         # Only attach ASN number(s)
         if 'bgppref' in ipinfo:
-            bgppref_rec = mongo.db.bgppref.find_one({'_id': ipinfo['bgppref']}, {'asn': 1})
+            if bgppref_recs is not None:
+                bgppref_rec = bgppref_recs.get(ipinfo['bgppref'])
+            else:
+                bgppref_rec = mongo.db.bgppref.find_one({'_id': ipinfo['bgppref']}, {'asn': 1})
             if bgppref_rec is None:
                 print("ERROR: Can't find BGP prefix '{}' in database (trying to enrich IP {})".format(ipinfo['bgppref'], ipinfo['_id']))
                 return
@@ -1340,54 +1636,102 @@ def attach_whois_data(ipinfo, full):
         return
     
     # Full - attach full records of related BGP prefix, ASNs, IP block, Org
+    if whois_recs is not None:
+        # All records are already loaded, no DB query is needed
+        if 'bgppref' in ipinfo:
+            _attach_bgppref_data(ipinfo, whois_recs)
+        if 'ipblock' in ipinfo:
+            _attach_ipblock_data(ipinfo, whois_recs)
+        return
+    # Both branches (IP->BGPpref->ASN->Org and IP->ipblock->Org) are independent,
+    # so if both are needed, the ipblock one is run in a thread pool in parallel
+    if 'bgppref' in ipinfo and 'ipblock' in ipinfo:
+        future = _whois_executor.submit(_attach_ipblock_data, ipinfo)
+        _attach_bgppref_data(ipinfo)
+        future.result()
+    elif 'bgppref' in ipinfo:
+        _attach_bgppref_data(ipinfo)
+    elif 'ipblock' in ipinfo:
+        _attach_ipblock_data(ipinfo)
+
+
+def _attach_bgppref_data(ipinfo, whois_recs=None):
+    """
+    Replace bgppref ID in ipinfo by full record and attach list of full ASN records (including their Orgs)
+
+    Records are taken from whois_recs (see load_whois_records) if given, otherwise they're loaded from DB.
+    """
     # IP->BGPpref
-    if 'bgppref' in ipinfo:
-        bgppref_rec = clean_secret_data(mongo.db.bgppref.find_one({'_id':ipinfo['bgppref']}))
-        if bgppref_rec is None:
-            print("ERROR: Can't find BGP prefix '{}' in database (trying to enrich IP {})".format(ipinfo['bgppref'], ipinfo['_id']))
-        else:
-            # BGPpref->ASN(s)
-            asn_list = []
-            for asn in bgppref_rec['asn']:
-                asn_rec = clean_secret_data(mongo.db.asn.find_one({'_id':asn}))
-                if asn_rec is None:
-                    print("ERROR: Can't find ASN '{}' in database (trying to enrich IP {}, bgppref {})".format(asn, ipinfo['_id'], bgppref_rec['_id']))
-                else:
-                    # ASN->Org
-                    if 'org' in asn_rec:
-                        org_rec = clean_secret_data(mongo.db.org.find_one({'_id':asn_rec['org']}))
-                        if org_rec is None:
-                            print("ERROR: Can't find Org '{}' in database (trying to enrich IP {}, bgppref {}, ASN {})".format(asn_rec['org'], ipinfo['_id'], bgppref_rec['_id'], asn))
-                        else:
-                            conv_dates(org_rec)
-                            asn_rec['org'] = org_rec
-
-                    del asn_rec['bgppref']
-                    conv_dates(asn_rec)
-                    asn_list.append(asn_rec)
-
-            del bgppref_rec['asn']
-            conv_dates(bgppref_rec)
-            ipinfo['bgppref'] = bgppref_rec
-            ipinfo['asn'] = asn_list
-
-    # IP->ipblock
-    if 'ipblock' in ipinfo:
-        ipblock_rec = clean_secret_data(mongo.db.ipblock.find_one({'_id':ipinfo['ipblock']}))
-        if ipblock_rec is None:
-            print("ERROR: Can't find IP block '{}' in database (trying to enrich IP {})".format(ipinfo['ipblock'], ipinfo['_id']))
+    if whois_recs is None:
+        bgppref_rec = mongo.db.bgppref.find_one({'_id':ipinfo['bgppref']})
+    else:
+        bgppref_rec = _copy_rec(whois_recs['bgppref'].get(ipinfo['bgppref']))
+    bgppref_rec = clean_secret_data(bgppref_rec)
+    if bgppref_rec is None:
+        print("ERROR: Can't find BGP prefix '{}' in database (trying to enrich IP {})".format(ipinfo['bgppref'], ipinfo['_id']))
+    else:
+        # BGPpref->ASN(s) (all ASN records and their Orgs are fetched by one query each)
+        if whois_recs is None:
+            asn_recs = {rec['_id']: rec for rec in mongo.db.asn.find({'_id': {'$in': bgppref_rec['asn']}})}
+            org_ids = list({rec['org'] for rec in asn_recs.values() if 'org' in rec})
+            org_recs = {rec['_id']: rec for rec in mongo.db.org.find({'_id': {'$in': org_ids}})} if org_ids else {}
         else:
-            # ipblock->org
-            if "org" in ipblock_rec:
-                org_rec = clean_secret_data(mongo.db.org.find_one({'_id':ipblock_rec['org']}))
-                if org_rec is None:
-                    print("ERROR: Can't find Org '{}' in database (trying to enrich IP {}, ipblock '{}')".format(ipblock_rec['org'], ipinfo['_id'], ipblock_rec['_id']))
-                else:
-                    conv_dates(org_rec)
-                    ipblock_rec['org'] = org_rec
+            asn_recs = whois_recs['asn']
+            org_recs = whois_recs['org']
+        asn_list = []
+        for asn in bgppref_rec['asn']:
+            asn_rec = clean_secret_data(_copy_rec(asn_recs.get(asn)))
+            if asn_rec is None:
+                print("ERROR: Can't find ASN '{}' in database (trying to enrich IP {}, bgppref {})".format(asn, ipinfo['_id'], bgppref_rec['_id']))
+            else:
+                # ASN->Org
+                if 'org' in asn_rec:
+                    org_rec = clean_secret_data(_copy_rec(org_recs.get(asn_rec['org'])))
+                    if org_rec is None:
+                        print("ERROR: Can't find Org '{}' in database (trying to enrich IP {}, bgppref {}, ASN {})".format(asn_rec['org'], ipinfo['_id'], bgppref_rec['_id'], asn))
+                    else:
+                        conv_dates(org_rec)
+                        asn_rec['org'] = org_rec
 
-            conv_dates(ipblock_rec)
-            ipinfo['ipblock'] = ipblock_rec
+                del asn_rec['bgppref']
+                conv_dates(asn_rec)
+                asn_list.append(asn_rec)
+
+        del bgppref_rec['asn']
+        conv_dates(bgppref_rec)
+        ipinfo['bgppref'] = bgppref_rec
+        ipinfo['asn'] = asn_list
+
+
+def _attach_ipblock_data(ipinfo, whois_recs=None):
+    """
+    Replace ipblock ID in ipinfo by full record (including its Org)
+
+    Records are taken from whois_recs (see load_whois_records) if given, otherwise they're loaded from DB.
+    """
+    if whois_recs is None:
+        ipblock_rec = mongo.db.ipblock.find_one({'_id':ipinfo['ipblock']})
+    else:
+        ipblock_rec = _copy_rec(whois_recs['ipblock'].get(ipinfo['ipblock']))
+    ipblock_rec = clean_secret_data(ipblock_rec)
+    if ipblock_rec is None:
+        print("ERROR: Can't find IP block '{}' in database (trying to enrich IP {})".format(ipinfo['ipblock'], ipinfo['_id']))
+    else:
+        # ipblock->org
+        if "org" in ipblock_rec:
+            if whois_recs is None:
+                org_rec = mongo.db.org.find_one({'_id':ipblock_rec['org']})
+            else:
+                org_rec = _copy_rec(whois_recs['org'].get(ipblock_rec['org']))
+            org_rec = clean_secret_data(org_rec)
+            if org_rec is None:
+                print("ERROR: Can't find Org '{}' in database (trying to enrich IP {}, ipblock '{}')".format(ipblock_rec['org'], ipinfo['_id'], ipblock_rec['_id']))
+            else:
+                conv_dates(org_rec)
+                ipblock_rec['org'] = org_rec
+
+        conv_dates(ipblock_rec)
+        ipinfo['ipblock'] = ipblock_rec
 
 
 def clean_secret_data(data):
@@ -1455,7 +1799,7 @@ def get_basic_info_dic_short(val):
 @app.route('/api/v1/ip/<ipaddr>')
 def get_basic_info(ipaddr=None):
     if not g.ac('ipsearch'):
-        return API_RESPONSE_403
+        return _resp_403()
 
     ret, val = get_ip_info(ipaddr, False)
     if not ret:
@@ -1463,91 +1807,101 @@ def get_basic_info(ipaddr=None):
 
     binfo = get_basic_info_dic(val)
 
-    return Response(json.dumps(binfo), 200, mimetype='application/json')
+    return jresp(binfo)
 
 
 # ***** NERD API Reputation/FMP only *****
 
+@cached(cache=TTLCache(maxsize=100000, ttl=60), lock=threading.Lock())
+def get_ip_field(ipint, field):
+    """
+    Load record of given IP from DB with only one field (and _id), return None if IP is not in DB.
+
+    Results are cached for 60 seconds (/rep and /fmp are the most frequently called API
+    endpoints, slightly outdated values are acceptable there). Returned dict must not be modified.
+    """
+    return mongo.db.ip.find_one({'_id': ipint}, {field: 1})
+
 @app.route('/api/v1/ip/<ipaddr>/rep')
 def get_ip_rep(ipaddr=None):
     if not g.ac('ipsearch'):
-        return API_RESPONSE_403
+        return _resp_403()
 
     # Check validity of ipaddr
     try:
         ipaddress.IPv4Address(ipaddr)
     except ValueError:
-        data = {'err_n': 400, 'error': 'Bad IP address'}
-        return Response(json.dumps(data), 400, mimetype='application/json')
+        return _resp_400(_ERR_400_BAD_IP_BYTES)
 
     ipint = ipstr2int(ipaddr)
 
     # Load 'rep' field of the IP from MongoDB
-    ipinfo = mongo.db.ip.find_one({'_id': ipint}, {'rep': 1})
+    ipinfo = get_ip_field(ipint, 'rep')
     if not ipinfo:
         data = {'err_n': 404, 'error': 'IP address not found', 'ip': ipaddr}
-        return Response(json.dumps(data), 404, mimetype='application/json')
+        return jresp(data, 404)
 
     # Return simple JSON
     data = {
         'ip': int2ipstr(ipinfo['_id']),
         'rep': ipinfo.get('rep', 0.0),
     }
-    return Response(json.dumps(data), 200, mimetype='application/json')
+    return jresp(data)
 
 
 @app.route('/api/v1/ip/<ipaddr>/fmp')
 def get_ip_fmp(ipaddr=None):
     if not g.ac('ipsearch'):
-        return API_RESPONSE_403
+        return _resp_403()
 
     # Check validity of ipaddr
     try:
         ipaddress.IPv4Address(ipaddr)
     except ValueError:
-        data = {'err_n': 400, 'error': 'Bad IP address'}
-        return Response(json.dumps(data), 400, mimetype='application/json')
+        return _resp_400(_ERR_400_BAD_IP_BYTES)
 
     ipint = ipstr2int(ipaddr)
 
     # Load 'fmp' field of the IP from MongoDB
-    ipinfo = mongo.db.ip.find_one({'_id': ipint}, {'fmp': 1})
+    ipinfo = get_ip_field(ipint, 'fmp')
     if not ipinfo:
         data = {'err_n': 404, 'error': 'IP address not found', 'ip': ipaddr}
-        return Response(json.dumps(data), 404, mimetype='application/json')
+        return jresp(data, 404)
 
     # Return simple JSON
     data = {
         'ip': int2ipstr(ipinfo['_id']),
         'fmp': ipinfo.get('fmp', {'general': 0.0}),
     }
-    return Response(json.dumps(data), 200, mimetype='application/json')
+    return jresp(data)
 
 
 
 @app.route('/api/v1/ip/<ipaddr>/test') # No query to database - for performance comparison
 def get_ip_rep_test(ipaddr=None):
     #if not g.ac('ipsearch'):
-    #    return API_RESPONSE_403
+    #    return _resp_403()
 
     # Return simple JSON
     data = {
         'ip': ipaddr,
         'rep': 0.0,
     }
-    return Response(json.dumps(data), 200, mimetype='application/json')
+    return jresp(data)
 
 # ***** NERD API FullInfo *****
 
 @app.route('/api/v1/ip/<ipaddr>/full')
 def get_full_info(ipaddr=None):
     if not g.ac('ipsearch'):
-        return API_RESPONSE_403
+        return _resp_403()
 
     ret, val = get_ip_info(ipaddr, True)
     if not ret:
         return val
 
+    # Format datetimes as YYYY-MM-DDTHH:MM:SS (isoformat is much faster than strftime)
+    iso = datetime.isoformat
     data = {
         'ip' : val['_id'],
         'rep' : val.get('rep', 0.0),
@@ -1557,14 +1911,14 @@ def get_full_info(ipaddr=None):
         'bgppref' : val.get('bgppref', ''),
         'asn' : val.get('asn',[]),
         'geo' : val.get('geo', None),
-        'ts_added' : val['ts_added'].strftime("%Y-%m-%dT%H:%M:%S"),
-        'ts_last_update' : val['ts_last_update'].strftime("%Y-%m-%dT%H:%M:%S"),
-        'last_activity' : val['last_activity'].strftime("%Y-%m-%dT%H:%M:%S") if 'last_activity' in val else None,
+        'ts_added' : iso(val['ts_added'], timespec='seconds'),
+        'ts_last_update' : iso(val['ts_last_update'], timespec='seconds'),
+        'last_activity' : iso(val['last_activity'], timespec='seconds') if 'last_activity' in val else None,
         'bl' : [ {
                 'name': bl['n'],
-                'last_check': bl['t'].strftime("%Y-%m-%dT%H:%M:%S"),
+                'last_check': iso(bl['t'], timespec='seconds'),
                 'last_result': True if bl['v'] else False,
-                'history': [t.strftime("%Y-%m-%dT%H:%M:%S") for t in bl['h']]
+                'history': [iso(t, timespec='seconds') for t in bl['h'][-BL_HISTORY_LIMIT:]]
             } for bl in val.get('bl', []) ],
         'events' : val.get('events', []),
         'misp_events' : val.get('misp_events', []),
@@ -1576,7 +1930,7 @@ def get_full_info(ipaddr=None):
         },
     }
 
-    return Response(json.dumps(data), 200, mimetype='application/json')
+    return jresp(data)
 
 # ***** NERD API IPSearch *****
 
@@ -1584,14 +1938,12 @@ def get_full_info(ipaddr=None):
 def ip_search(full = False):
     err = {}
     if not g.ac('ipsearch'):
-        return API_RESPONSE_403
+        return _resp_403()
 
     # Get output format
     output = request.args.get('o', 'json')
     if output not in ('json', 'list', 'short'):
-        err['err_n'] = 400
-        err['error'] = 'Unrecognized value of output parameter: ' + output
-        return Response(json.dumps(err), 400, mimetype='application/json')
+        return _resp_400(_err_bad_output_bytes(output))
 
     list_output = (output == "list")
 
@@ -1606,7 +1958,7 @@ def ip_search(full = False):
     if not form.validate():
         err['err_n'] = 400
         err['error'] = 'Bad parameters: ' + '; '.join('{}: {}'.format(name, ', '.join(errs)) for name, errs in form.errors.items())
-        return Response(json.dumps(err), 400, mimetype='application/json')
+        return jresp(err, 400)
 
     # Perform DB query
     sortby = sort_mapping[form.sortby.data]
@@ -1616,88 +1968,106 @@ def ip_search(full = False):
         outputfields =  {'_id': 1}
     elif output == "short": # short output format, only rep. score and tags are needed
         outputfields = {'_id': 1, 'rep': 1, 'tags': 1}
-    elif output == "json": # normal output, get everything except 'events' (which are long and not needed)
-        outputfields = {'events': 0}
+    elif output == "json": # normal output, only fields used by get_basic_info_dic (so long arrays like 'events' or 'bl.h' aren't transferred)
+        outputfields = BASIC_INFO_PROJECTION
     
     try:
-        results = mongo.db.ip.find(query, outputfields).limit(form.limit.data)  # note: limit=0 means no limit
+        # Build the whole query (sort, then limit) before it's sent, so DB can use an index for sorting
+        results = mongo.db.ip.find(query, outputfields)
         if sortby != "none":
-            results.sort(sortby, 1 if form.asc.data else -1)
-        results = list(results)
+            results = results.sort(sortby, 1 if form.asc.data else -1)
+        results = results.limit(form.limit.data)  # note: limit=0 means no limit
+        if list_output:
+            # List is streamed directly from the cursor, only get the first result now to catch DB errors here
+            results = results.batch_size(5000)
+            first = next(results, None)
+        else:
+            # Get all results in one batch if possible (default first batch is only 101 records)
+            results = results.batch_size(form.limit.data if form.limit.data and form.limit.data > 0 else 10000)
+            # Process records as they are read from the cursor (in one pass)
+            lres = []
+            if output == "short":
+                for res in results:
+                    res['_id'] = int2ipstr(res['_id']) # Convert _id from int to dotted-decimal string
+                    lres.append(get_basic_info_dic_short(res))
+            elif full:
+                # Get all related whois records (BGP prefixes, ASNs, IP blocks, Orgs) by one query per collection
+                results = list(results)
+                whois_recs = load_whois_records(results)
+                for res in results:
+                    res['_id'] = int2ipstr(res['_id']) # Convert _id from int to dotted-decimal string
+                    attach_whois_data(res, full, whois_recs=whois_recs)
+                    lres.append(get_basic_info_dic(res))
+            else:
+                # Get ASNs for all results by a single query
+                results = list(results)
+                bgppref_recs = get_bgppref_asns({res['bgppref'] for res in results if 'bgppref' in res})
+                for res in results:
+                    res['_id'] = int2ipstr(res['_id']) # Convert _id from int to dotted-decimal string
+                    attach_whois_data(res, full, bgppref_recs)
+                    lres.append(get_basic_info_dic(res))
     except pymongo.errors.ServerSelectionTimeoutError:
-        err['err_n'] = 503
-        err['error'] = 'Database connection error'
-        return Response(json.dumps(err), 503, mimetype='application/json')
+        return _resp_503_db()
 
     # Return results
-    if output == "list":
-        return Response(''.join(int2ipstr(res['_id'])+'\n' for res in results), 200, mimetype='text/plain')
-
-    # Convert _id from int to dotted-decimal string        
-    for res in results:
-        res['_id'] = int2ipstr(res['_id'])
-
-    lres = []
-    if output == "short":
-        for res in results:
-            lres.append(get_basic_info_dic_short(res))
-    else:    
-        for res in results:
-            attach_whois_data(res, full)
-            lres.append(get_basic_info_dic(res))
-
-    return Response(json.dumps(lres), 200, mimetype='application/json')
+    if list_output:
+        return stream_ip_list(first, results)
+    return jresp(lres)
 
 
 # ***** Get summary info about IPs in given prefix *****
 # Return:
 #  - average reputation score of the prefix (sum of rep of present addresses divided by prefix size)
 #  - number of IPs in the DB in the prefix
-#  - list of the IPs
+#  - list of the IPs (omitted if "summary=1" is passed)
 
 @app.route('/api/v1/prefix/<prefix>/<length>')
 def prefix(prefix, length):
-    err = {}
     if not g.ac('ipsearch'):
-        return API_RESPONSE_403
+        return _resp_403()
     
-    # Check parameters
-    try:
-        network = ipaddress.IPv4Network(prefix + '/' + length, strict=False)
-    except ValueError:
-        err['err_n'] = 400
-        err['error'] = 'Bad parameters: invalid prefix'
-        return Response(json.dumps(err), 400, mimetype='application/json')
-    if network.prefixlen < 16:
-        err['err_n'] = 400
-        err['error'] = 'Bad parameters: the shortest supported prefix is /16'
-        return Response(json.dumps(err), 400, mimetype='application/json')
+    # Check parameters (parsed manually, ipaddress.IPv4Network is quite slow)
+    base = parse_ipv4(prefix)
+    prefixlen = parse_prefixlen(length)
+    if base < 0 or prefixlen < 0:
+        return _resp_400(_ERR_400_BAD_PREFIX_BYTES)
+    if prefixlen < 16:
+        return _resp_400(_ERR_400_SHORT_PREFIX_BYTES)
     
     # Get list of all IPs from DB matching the prefix
-    int_prefix_start = int(network.network_address)
-    int_prefix_end = int(network.broadcast_address)
-    query = {'$and': [{'_id': {'$gte': int_prefix_start}}, {'_id': {'$lt': int_prefix_end}}]}
+    host_bits = 32 - prefixlen
+    num_addresses = 1 << host_bits
+    int_prefix_start = base >> host_bits << host_bits # clear host bits (like strict=False)
+    int_prefix_end = int_prefix_start + num_addresses - 1
+    query = {'_id': {'$gte': int_prefix_start, '$lte': int_prefix_end}}
+    # If only the summary is requested (?summary=1), it's computed by DB and the list of IPs is omitted
+    summary_only = request.args.get('summary', '') in ('1', 'true')
     try:
-        results = mongo.db.ip.find(query)
-        results = list(results)
+        if summary_only:
+            agg = list(mongo.db.ip.aggregate([
+                {'$match': query},
+                {'$group': {'_id': None, 'sum_rep': {'$sum': '$rep'}, 'n': {'$sum': 1}}},
+            ]))
+            sum_rep, num_ips = (agg[0]['sum_rep'], agg[0]['n']) if agg else (0.0, 0)
+        else:
+            results = mongo.db.ip.find(query, {'_id': 1, 'rep': 1}).hint([('_id', ASCENDING)]).batch_size(10000)
+            # Create a summary record (in one pass over the cursor)
+            sum_rep = 0.0
+            ips = []
+            for rec in results:
+                sum_rep += rec.get('rep', 0.0)
+                ips.append(int2ipstr(rec['_id']))
+            num_ips = len(ips)
     except pymongo.errors.ServerSelectionTimeoutError:
-        err['err_n'] = 503
-        err['error'] = 'Database connection error'
-        return Response(json.dumps(err), 503, mimetype='application/json')
-    
-    # Create a summary record
-    sum_rep = 0.0
-    ips = []
-    for rec in results:
-        sum_rep += rec.get('rep', 0.0)
-        ips.append(int2ipstr(rec['_id']))
+        return _resp_503_db()
 
     result = {
-        'rep': sum_rep / network.num_addresses,
-        'num_ips': len(results),
-        'ips': ips,
+        'rep': sum_rep / num_addresses,
+        'num_ips': num_ips,
     }
-    return Response(json.dumps(result), 200, mimetype='application/json')
+    if not summary_only:
+        result['ips'] = ips
+    return jresp(result)
     
 
 # ***** NERD bad prefix list *****
@@ -1709,9 +2079,8 @@ def prefix(prefix, length):
 
 @app.route('/api/v1/bad_prefixes')
 def bad_prefixes():
-    err = {}
     if not g.ac('ipsearch'):
-        return API_RESPONSE_403
+        return _resp_403()
 
     # Parse parameters (threshold, limit)
 #     form = BadPrefixForm(request.args)
@@ -1725,30 +2094,45 @@ def bad_prefixes():
         t = float(request.args.get('t', 0.01))
         limit = int(request.args.get('limit', 100))
     except ValueError:
-        err['err_n'] = 400
-        err['error'] = 'Bad parameters'
-        return Response(json.dumps(err), 400, mimetype='application/json')
+        return _resp_400(_ERR_400_BAD_PARAMS_BYTES)
+
+    output = request.args.get('o', "json")
+    if output not in ('json', 'text'):
+        return _resp_400(_err_bad_output_bytes(output))
     
     # Get the list of prefixes from database
     try:
         cursor = mongo.db.bgppref.find({"rep": {"$gt": t}}, {"rep": 1}).sort("rep", -1).limit(limit)
-        results = list(cursor)
+        if limit > 0:
+            cursor.batch_size(limit) # get all results in one batch
+        if output == "json":
+            # Build the output directly from the cursor
+            res_list = [{'prefix': res['_id'], 'rep': res['rep']} for res in cursor]
+        else:
+            # Text is streamed directly from the cursor, only get the first result now to catch DB errors here
+            first = next(cursor, None)
     except pymongo.errors.ServerSelectionTimeoutError:
-        err['err_n'] = 503
-        err['error'] = 'Database connection error'
-        return Response(json.dumps(err), 503, mimetype='application/json')
+        return _resp_503_db()
 
     # Prepare output
-    output = request.args.get('o', "json")
     if output == "json":
-        res_list = [{'prefix': res['_id'], 'rep': res['rep']} for res in results]
-        return Response(json.dumps(res_list), 200, mimetype='application/json')
-    elif output == "text":
-        return Response('\n'.join(res['_id']+'\t'+str(res['rep']) for res in results), 200, mimetype='text/plain')
-    else:
-        err['err_n'] = 400
-        err['error'] = 'Unrecognized value of output parameter: ' + output
-        return Response(json.dumps(err), 400, mimetype='application/json')
+        return jresp(res_list)
+    if first is None:
+        return Response('', 200, mimetype='text/plain')
+
+    # Stream lines as the results are read from the cursor (in chunks of 1000 lines)
+    def generate():
+        lines = [first['_id'] + '\t' + str(first['rep'])]
+        sep = '' # lines are separated by newline, there's none after the last one
+        for res in cursor:
+            lines.append(res['_id'] + '\t' + str(res['rep']))
+            if len(lines) >= 1000:
+                yield sep + '\n'.join(lines)
+                lines = []
+                sep = '\n'
+        if lines:
+            yield sep + '\n'.join(lines)
+    return Response(stream_with_context(generate()), 200, mimetype='text/plain')
 
 
 """
@@ -1766,7 +2150,7 @@ Returned data contain an octet stream. Each 8 bytes represent a double precision
 @app.route('/api/v1/ip/bulk/', methods=['POST'])
 def bulk_request():
     if not g.ac('ipsearch'):
-        return API_RESPONSE_403
+        return _resp_403()
 
     ips = request.get_data()
 
@@ -1775,27 +2159,25 @@ def bulk_request():
         ips = ips.decode("ascii")
         ip_list = [ipstr2int(ipstr) for ipstr in ips.split(',')]
     elif f == 'application/octet-stream':
-        ip_list = []
-        for x in range(0, int(len(ips) / 4)):
-            addr, = struct.unpack('!I', ips[x * 4 : x * 4 + 4])
-            ip_list.append(addr)
+        # Array of 32bit integers in network byte order, parse it at once (any trailing incomplete item is ignored)
+        ip_list = list(struct.unpack_from('!%dI' % (len(ips) // 4), ips))
     else:
-        return Response(json.dumps({'err_n': 400, 'error': 'Unsupported input data format: ' + f}), 400, mimetype='application/json')
+        return jresp({'err_n': 400, 'error': 'Unsupported input data format: ' + f}, 400)
+
+    results = dict.fromkeys(ip_list, 0.0)
 
-    results = {el:0.0 for el in ip_list}
+    res = mongo.db.ip.find({"_id": {"$in": ip_list}}, {"_id":1, "rep":1}).batch_size(len(ip_list))
+    for ip in res:
+        results[ip['_id']] = ip.get('rep', 0.0)
 
-    res = mongo.db.ip.find({"_id": {"$in": ip_list}}, {"_id":1, "rep":1})
-    if res:
-        for ip in res:
-            results[ip['_id']] = ip.get('rep', 0.0)
+    # Reputation scores in the same order as IPs were passed
+    reps = list(map(results.__getitem__, ip_list))
 
     if f == 'text/plain':
-        return Response(''.join(['%s\n' % results[val] for val in ip_list]), 200, mimetype='text/plain')
+        return Response(''.join(['%s\n' % rep for rep in reps]), 200, mimetype='text/plain')
     elif f == 'application/octet-stream':
-        resp = bytearray()
-        for x in ip_list:
-            resp += struct.pack("d", results[x])
-        return Response(resp, 200, mimetype='application/octet-stream')
+        # Array of doubles (in native byte order), packed at once
+        return Response(struct.pack('%dd' % len(reps), *reps), 200, mimetype='application/octet-stream')
 
 
 # Custom error 404 handler for API
@@ -1807,42 +2189,49 @@ def page_not_found(e):
             'err_n': 404,
             'error': "Not Found - unrecognized API path",
         }
-        return Response(json.dumps(err), 404, mimetype='application/json')
+        return jresp(err, 404)
     else:
         # Otherwise return default error page
         return e
 
 
 # ***** Passive DNS gateway *****
+
+# Connections to the PDNS server are kept open and reused by subsequent requests
+_pdns_session = requests.Session()
+_pdns_session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=64))
+_pdns_session.mount('http://', HTTPAdapter(pool_connections=16, pool_maxsize=64))
+PDNS_TIMEOUT = 10 # seconds
+
 @app.route('/pdns/ip/<ipaddr>', methods=['GET'])
 def pdns_ip(ipaddr=None):
     if not g.ac('pdns'):
-        return API_RESPONSE_403
+        return _resp_403()
     url = config.get('pdns.url', None)
     token = config.get('pdns.token', None)
     if not url or not token:
-        return Response(json.dumps({'status': 500, 'error': 'Passive DNS not configured'}), 500, mimetype='application/json')
+        return jresp({'status': 500, 'error': 'Passive DNS not configured'}, 500)
     try:
-        response = requests.get('{}ip/{}?token={}'.format(url, ipaddr, token))
+        response = _pdns_session.get('{}ip/{}'.format(url, ipaddr), params={'token': token}, timeout=PDNS_TIMEOUT)
     except requests.RequestException as e: # Connection error, just in case
         print(str(e), file=sys.stderr)
-        return Response(json.dumps({'status': 502, 'error': 'Bad Gateway - cannot get information from PDNS server'}), 502, mimetype='application/json')
+        return jresp({'status': 502, 'error': 'Bad Gateway - cannot get information from PDNS server'}, 502)
     if response.status_code == 200:
-        return Response(json.dumps(response.json()), 200, mimetype='application/json')
+        return jresp(response.json())
     elif response.status_code == 404: # Return "not found" as success, just with empty list
         return Response("[]", 200, mimetype='application/json')
     else:
-        return Response(json.dumps({'status': 502, 'error': 'Bad Gateway. Received response ({}): {}'.format(response.status_code, response.text)}), 502, mimetype='application/json')
+        return jresp({'status': 502, 'error': 'Bad Gateway. Received response ({}): {}'.format(response.status_code, response.text)}, 502)
 
 
 # ***** Shodan gateway *****
 @app.route('/api/shodan-info/<ipaddr>', methods=['GET'])
 def get_shodan_response(ipaddr=None):
     if not g.ac('shodan'):
-        return API_RESPONSE_403
+        return _resp_403()
     #print("(Shodan) got an incoming request {}".format(ipaddr))
     shodan_client = ShodanRpcClient()
-    data = json.loads(shodan_client.call(ipaddr))
+    data = _json_loads(shodan_client.call(ipaddr))
     return render_template('shodan_response.html', data=data)
 
 # **********
@@ -1,8 +1,18 @@
 """
 NERDd - config file reader
 """
+import os
+import logging
+import copy
+import types
+import collections.abc
+import ast
+import importlib.util
 import yaml
 
+# Use the libyaml-based loader if available (much faster), pure-Python one otherwise
+YAMLLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
 class NoDefault:
     pass
 
@@ -70,6 +80,66 @@ class HierarchicalDict(dict):
         return HierarchicalDict(dict.copy(self))
 
 
+def _flatten(d, prefix, out):
+    """Store all values of nested dicts 'd' into 'out' under dotted-path keys."""
+    for key, val in d.items():
+        if not isinstance(key, str) or '.' in key:
+            continue # such keys can't be accessed by hierarchical_get anyway
+        path = prefix + key
+        out[path] = val
+        if isinstance(val, dict):
+            _flatten(val, path + '.', out)
+
+
+class FrozenConfig(collections.abc.Mapping):
+    """
+    Read-only variant of HierarchicalDict.
+
+    All hierarchical keys are precomputed when the object is created, so
+    "get" with a key like 'abc.x.y' is a single dict lookup.
+    Only the top-level mapping is read-only, nested values are returned as they
+    are (don't modify them).
+    """
+    __slots__ = ('_data', '_flat')
+
+    def __init__(self, data):
+        data = dict(data)
+        flat = {}
+        _flatten(data, '', flat)
+        self._data = types.MappingProxyType(data)
+        self._flat = types.MappingProxyType(flat)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return 'FrozenConfig({!r})'.format(dict(self._data))
+
+    def __reduce__(self):
+        # MappingProxyType can't be pickled, rebuild from plain dict instead
+        return (FrozenConfig, (dict(self._data),))
+
+    def get(self, key, default=NoDefault):
+        """Return self[key] or "default" if key is not found. See hierarchical_get."""
+        try:
+            return self._flat[key]
+        except KeyError:
+            pass
+        if default is NoDefault:
+            raise MissingConfigError("Mandatory configuration element is missing: " + key)
+        return default
+
+
+# Cache of already parsed config files: realpath -> ((mtime_ns, size), parsed_data)
+_CACHE = {}
+
+
 def read_config(file):
     """
     Read configuration file and return config as a dict-like object.
@@ -82,8 +152,74 @@ def read_config(file):
     The only difference from normal dict is its "get" method, which allows
     hierarchical keys (e.g. 'abc.x.y'). See doc of "hierarchical_get" function
     for more information.
+
+    Parsed files are cached in memory, the cache is invalidated when the
+    file's mtime or size changes. A new copy of the data is returned on each
+    call, so it can be safely modified.
+    """
+    path = os.path.realpath(file)
+    st = os.stat(path)
+    version = (st.st_mtime_ns, st.st_size)
+    cached = _CACHE.get(path)
+    if cached is None or cached[0] != version:
+        with open(path) as f:
+            cached = (version, yaml.load(f, Loader=YAMLLoader))
+        _CACHE[path] = cached
+    return HierarchicalDict(copy.deepcopy(cached[1]))
+
+def write_compiled_config(out_file, config, source_files):
+    """
+    Store config as a Python module (CONFIG = {...}) to be loaded by load_compiled_config.
+
+    The module also contains mtimes of source_files (the first one should be
+    the main config file), so it's possible to detect it's outdated.
+    Raises ValueError if the config can't be expressed as a Python literal.
+
+    The config contains secrets (DB passwords, API keys), so the file is only
+    readable by its owner (the user running this function).
     """
-    return HierarchicalDict(yaml.safe_load(open(file)))
+    config_str = repr(dict(config)) # repr keeps the order of keys
+    ast.literal_eval(config_str) # check it's a valid literal (raises ValueError otherwise)
+    sources = {os.path.realpath(f): os.stat(f).st_mtime_ns for f in source_files}
+    tmp_file = out_file + '.tmp' + str(os.getpid())
+    fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600) # in case the file already existed
+    with open(fd, 'w') as f:
+        f.write('# Generated by scripts/compile_config.py, do not edit\n')
+        f.write('_SOURCE_MTIME_NS = {!r}\n'.format(sources))
+        f.write('CONFIG = {}\n'.format(config_str))
+    os.replace(tmp_file, out_file)
+
+
+def load_compiled_config(compiled_file, main_file):
+    """
+    Load config stored by write_compiled_config, return it as HierarchicalDict.
+
+    Return None if the file doesn't exist, wasn't created from main_file or
+    any of its source files has changed since.
+    Since the file is executed, it's also refused (None is returned) if it's
+    not owned by the current user (or root) or it's writable by group/others.
+    """
+    try:
+        st = os.stat(compiled_file)
+        if st.st_uid not in (os.geteuid(), 0) or st.st_mode & 0o022:
+            return None
+        spec = importlib.util.spec_from_file_location('nerd_config_compiled', compiled_file)
+        mod = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(mod)
+        sources = mod._SOURCE_MTIME_NS
+        if next(iter(sources), None) != os.path.realpath(main_file):
+            return None
+        for path, mtime_ns in sources.items():
+            if os.stat(path).st_mtime_ns != mtime_ns:
+                return None
+        return HierarchicalDict(mod.CONFIG)
+    except FileNotFoundError:
+        return None # not compiled (or a source file was removed)
+    except Exception as e:
+        # Any problem with the file (e.g. truncated or edited by hand) -> fall back to YAML
+        logging.getLogger('config').warning("Can't load compiled config '%s', falling back to YAML: %r", compiled_file, e)
+        return None
 
 # ***** Unit tests *****
 # TODO 'update' is tested only, test 'get' as well
@@ -203,5 +339,19 @@ if __name__ == '__main__':
             res.update([])
             res.update(HierarchicalDict())
             self.assertEqual(res, d1, "dict has changed after update by empty dict")
+
+    class FrozenConfigTest(unittest.TestCase):
+        def runTest(self):
+            d = HierarchicalDict({'a': 1, 'b': {'b1': {'x': 'y'}, 'b2': [1, 2]}})
+            fc = FrozenConfig(d)
+            self.assertEqual(dict(fc), d)
+            for key in ('a', 'b', 'b.b1', 'b.b1.x', 'b.b2'):
+                self.assertEqual(fc.get(key), d.get(key), "get('{}') differs from HierarchicalDict".format(key))
+            self.assertEqual(fc.get('b.c', 'def'), 'def')
+            self.assertRaises(MissingConfigError, fc.get, 'b.c')
+            with self.assertRaises(TypeError):
+                fc['a'] = 2
+            import pickle
+            self.assertEqual(pickle.loads(pickle.dumps(fc)).get('b.b1.x'), 'y')
     
     unittest.main()
@@ -51,7 +51,7 @@ class MentatEventDBProxy:
         if not self.api_key:
             self.log.error("Mentat API used but api_key not configured ('eventdb_mentat.api_key' config entry is missing)")
 
-    def get(self, etype, key, limit=None, dt_from=None):
+    def get(self, etype, key, limit=None, dt_from=None, with_duration=False):
         """
         Return all events where given IP is among Sources.
         
@@ -60,6 +60,8 @@ class MentatEventDBProxy:
         key     entity identifier (str), e.g. '192.0.2.42'
         limit   max number of returned events
         dt_from minimal value of DetectTime (datetime) 
+        with_duration if True, '_duration' key with the duration of the event in
+                seconds is added to each message where it can be computed
         
         Return a list of IDEA messages (strings).
         
@@ -92,6 +94,22 @@ class MentatEventDBProxy:
             #self.log.error("Invalid data received from Mentat database: req. URL: '{}', req. body: '{}', resp. code: {}, resp. body: '{}'".format(resp.request.url, resp.request.body, resp.status_code, resp.text))
             raise GatewayError("Invalid data received from Mentat database")
         
+        if with_duration:
+            # Mentat can't compute it, parse the times here
+            for event in result:
+                start = end = None
+                try:
+                    if event.get("EventTime") and event.get("CeaseTime"):
+                        start = parse_rfc_time(event['EventTime'])
+                        end = parse_rfc_time(event['CeaseTime'])
+                    elif event.get("WinStartTime") and event.get("WinEndTime"):
+                        start = parse_rfc_time(event['WinStartTime'])
+                        end = parse_rfc_time(event['WinEndTime'])
+                except ValueError:
+                    pass # Invalid format of some time specification
+                if start and end:
+                    event["_duration"] = (end - start).total_seconds()
+        
         return result
         
 
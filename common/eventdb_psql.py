@@ -47,7 +47,7 @@ class PSQLEventDatabase:
             pass
 
 
-    def get(self, etype, key, limit=None, dt_from=None):
+    def get(self, etype, key, limit=None, dt_from=None, with_duration=False):
         """
         Return all events where given IP is among Sources.
         
@@ -56,6 +56,10 @@ class PSQLEventDatabase:
         key     entity identifier (str), e.g. '192.0.2.42'
         limit   max number of returned events
         dt_from minimal value of DetectTime (datetime)
+        with_duration if True, '_duration' key with the duration of the event in
+                seconds (CeaseTime - EventTime, or WinEndTime - WinStartTime if
+                any of the former is missing) is added to each message where
+                it can be computed
         
         Return a list of IDEA messages (strings).
         
@@ -64,20 +68,37 @@ class PSQLEventDatabase:
         if etype != 'ip':
             raise BadEntityType("etype must be 'ip'")
         
+        # starttime/endtime columns contain "EventTime or WinStartTime" and "CeaseTime or WinEndTime",
+        # so they can be used to compute duration only if both or none of EventTime and CeaseTime are present
+        # (otherwise NULL is returned and duration is computed from WinStartTime/WinEndTime below)
+        if with_duration:
+            columns = "e.idea, CASE WHEN (e.idea ? 'EventTime') = (e.idea ? 'CeaseTime') THEN EXTRACT(EPOCH FROM (e.endtime - e.starttime)) END"
+        else:
+            columns = "e.idea"
         cur = self.db.cursor()
         if dt_from is None:
-            sql = "SELECT e.idea FROM events_sources as es INNER JOIN events as e ON es.message_id = e.id WHERE es.source_ip = %s ORDER BY es.detecttime DESC LIMIT %s"
+            sql = "SELECT " + columns + " FROM events_sources as es INNER JOIN events as e ON es.message_id = e.id WHERE es.source_ip = %s ORDER BY es.detecttime DESC LIMIT %s"
             data = (Inet(key), limit)
         elif isinstance(dt_from, datetime.datetime):
-            sql = "SELECT e.idea FROM events_sources as es INNER JOIN events as e ON es.message_id = e.id WHERE es.source_ip = %s AND es.detecttime >= %s ORDER BY es.detecttime DESC LIMIT %s"
+            sql = "SELECT " + columns + " FROM events_sources as es INNER JOIN events as e ON es.message_id = e.id WHERE es.source_ip = %s AND es.detecttime >= %s ORDER BY es.detecttime DESC LIMIT %s"
             data = (Inet(key), dt_from, limit)
         else:
             raise TypeError("dt_from must be datetime instance")
         cur.execute(sql, data)
         self.db.commit() # Every query automatically opens a transaction, close it.
         
-        result = cur.fetchall()
-        result = [row[0] for row in result]
+        rows = cur.fetchall()
+        result = [row[0] for row in rows]
+        if with_duration:
+            for idea, duration in zip(result, (row[1] for row in rows)):
+                if duration is not None: # NULL if any of the times is unknown
+                    idea['_duration'] = float(duration)
+                elif idea.get('WinStartTime') and idea.get('WinEndTime') and ('EventTime' in idea) != ('CeaseTime' in idea):
+                    # Only one of EventTime/CeaseTime is present, use the window times (rare)
+                    try:
+                        idea['_duration'] = (parse_rfc_time(idea['WinEndTime']) - parse_rfc_time(idea['WinStartTime'])).total_seconds()
+                    except ValueError:
+                        pass # Invalid format of some time specification
         
         return result
         
@@ -3,10 +3,23 @@ NERD: auxiliary/utilitiy functions and classes
 """
 import re
 import datetime
+import socket
+import struct
 
 ipv4_re = re.compile(r"^([0-9]{1,3})\.([0-9]{1,3})\.([0-9]{1,3})\.([0-9]{1,3})$")
 
+_ipv4_octet_fullmatch = re.compile(r"[0-9]{1,3}").fullmatch
+
+_pack_u32 = struct.Struct('!I').pack
+_unpack_u32 = struct.Struct('!I').unpack
+
 def ipstr2int(s):
+    # Fast path - standard dotted-decimal format, parsed in C
+    try:
+        return _unpack_u32(socket.inet_pton(socket.AF_INET, s))[0]
+    except OSError:
+        pass
+    # Other strings (e.g. with leading zeros in octets) are handled by regex as before
     res = ipv4_re.match(s)
     if res is None:
         raise ValueError('Invalid IPv4 format: {!r}'.format(s))
@@ -14,8 +27,29 @@ def ipstr2int(s):
     # Check if octets are between 0 and 255 is omitted for better performance
     return int(a1) << 24 | int(a2) << 16 | int(a3) << 8 | int(a4)
 
+def parse_ipv4(s):
+    """
+    Parse IPv4 address in dotted-decimal format, return it as int or -1 if it's not valid.
+
+    Unlike ipstr2int, octets are fully checked (0-255, no leading zeros), so it
+    can be used to check validity of an address (and it's cheaper than
+    ipaddress.IPv4Address since no object nor exception is created).
+    """
+    parts = s.split('.')
+    if len(parts) != 4:
+        return -1
+    res = 0
+    for part in parts:
+        if not _ipv4_octet_fullmatch(part) or (part[0] == '0' and len(part) > 1):
+            return -1
+        n = int(part)
+        if n > 255:
+            return -1
+        res = res << 8 | n
+    return res
+
 def int2ipstr(i):
-    return '.'.join((str(i >> 24), str((i >> 16) & 0xff), str((i >> 8) & 0xff), str(i & 0xff)))
+    return socket.inet_ntoa(_pack_u32(i))
 
 
 # Regex for RFC 3339 time format
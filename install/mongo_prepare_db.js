@@ -7,6 +7,16 @@ db.ip.createIndex({"last_activity":-1},{background: true})
 db.ip.createIndex({"hostname":1},{background: true})
 db.ip.createIndex({"bl.n": 1, "bl.v": 1},{partialFilterExpression: {"bl": {$exists: true}}, background: true} )
 db.ip.createIndex({"dbl.n": 1, "dbl.v": 1},{partialFilterExpression: {"dbl": {$exists: true}}, background: true} )
+db.ip.createIndex({"events.cat":1},{background: true})
+db.ip.createIndex({"events.node":1},{background: true})
+// Tags are stored as {tag_id: {confidence: ..., ...}}, so a wildcard index is needed, which is only supported by MongoDB >= 4.2
+// (on older versions tag searches stay unindexed, as before)
+var mongo_version = db.version().split(".").map(Number)
+if (mongo_version[0] > 4 || (mongo_version[0] == 4 && mongo_version[1] >= 2)) {
+  db.ip.createIndex({"tags.$**":1},{background: true})
+} else {
+  print("MongoDB " + db.version() + " doesn't support wildcard indexes, index on 'tags' not created")
+}
 db.ip.createIndex({"rep":-1},{background: true})
 db.ip.createIndex({"bgppref":1},{background: true})
 db.ip.createIndex({"ipblock":1},{background: true})
@@ -242,7 +242,7 @@ def save_blacklist_to_redis(bl_records, bl_id, bl_name, bl_type, prefix_bl_lengt
     :param prefix_bl_length: length of prefixIP blacklist, if blacklist type is prefixIP (was calculated during parsing)
     :return: None
     """
-    now = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    now = datetime.now().isoformat(timespec='seconds')
     key_prefix = bl_all_types[bl_type]['db_prefix'] + bl_id + ":"
     # Put the list into Redis
     # Buffer all Redis commands into a Pipeline, so they're all send in a
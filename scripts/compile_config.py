@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Compile NERDd configuration (nerdd.yml + common nerd.yml) into a Python module.
+
+Workers load the compiled module instead of parsing YAML on start, as long as
+none of the source files has changed since it was generated (otherwise they
+fall back to YAML, so it's safe to forget to re-run this script).
+"""
+
+import os
+import sys
+import argparse
+
+# Add to path the "one directory above the current file location" to find modules from "common"
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')))
+
+from common.config import read_config, write_compiled_config
+
+DEFAULT_OUTPUT_FILE = '/var/cache/nerd/config_compiled.py'
+
+parser = argparse.ArgumentParser(
+    prog="compile_config.py",
+    description="Compile NERDd configuration into a Python module, which is faster to load than YAML."
+)
+parser.add_argument('-c', '--config', metavar='FILENAME', default='/etc/nerd/nerdd.yml',
+                    help='Path to backend configuration file (default: /etc/nerd/nerdd.yml)')
+parser.add_argument('-o', '--output', metavar='FILENAME', default=DEFAULT_OUTPUT_FILE,
+                    help='Output file (default: {})'.format(DEFAULT_OUTPUT_FILE))
+args = parser.parse_args()
+
+# Load and merge config the same way as worker.py does
+config = read_config(args.config)
+common_cfg_file = os.path.join(os.path.dirname(os.path.abspath(args.config)), config.get('common_config'))
+config.update(read_config(common_cfg_file))
+
+try:
+    write_compiled_config(args.output, config, [args.config, common_cfg_file])
+except (OSError, ValueError) as e:
+    print("ERROR: Can't write compiled config to '{}': {}".format(args.output, e), file=sys.stderr)
+    sys.exit(1)
+print("Compiled config written to", args.output)